@@ -0,0 +1,240 @@
+#!/usr/bin/python
+
+# A local stand-in for the JIRA search API, serving generated issues.
+#
+# To run on its own:
+#     `./benchmarks/fake_jira.py --issues 10000 --port 8765`
+
+
+from argparse import ArgumentParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime, timedelta
+import httplib
+import json
+import random
+import re
+from SocketServer import ThreadingMixIn
+from threading import Thread
+from urlparse import parse_qs, urlparse
+
+
+DAYS_OF_HISTORY = 2 * 365
+MAX_RESULTS = 100  # Jira Cloud's cap on maxResults
+# Search results only embed the first histories of each changelog.
+EMBEDDED_CHANGELOG_SIZE = 100
+PRIORITIES = (('P1', .1), ('P2', .3), ('P3', .4), ('P4', .2))
+ISSUE_TYPES = (('Story', .55), ('Bug', .3), ('Task', .13), ('Epic', .02))
+STORY_POINTS = (None, 1, 1, 2, 2, 3, 3, 5, 8, 13)
+OPEN_STATUSES = ('Open', 'In Progress', 'In Review')
+DONE_STATUSES = ('Done', 'Closed')
+STORY_POINTS_FIELD = 'customfield_10002'
+EPIC_LINK_FIELD = 'customfield_10008'
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.000-0800'
+UPDATED_SINCE = re.compile(r'updated\s*>=\s*"([\d-]+)"')
+KEY_IN = re.compile(r'key\s+in\s*\(([^)]*)\)', re.IGNORECASE)
+CHANGELOG_PATH = re.compile(r'^/rest/api/2/issue/([^/]+)/changelog$')
+
+
+def weighted_choice(rng, choices):
+    value = rng.random()
+    for choice, weight in choices:
+        value -= weight
+        if value < 0:
+            return choice
+    return choices[-1][0]
+
+def change(timestamp, field, from_value, to_value):
+    return {
+        'created': timestamp.strftime(TIMESTAMP_FORMAT),
+        'items': [{'field': field, 'fieldId': field, 'fromString': from_value, 'toString': to_value}],
+    }
+
+# A changelog that ends in the issue's current status, priority and points,
+# with some issues reopened, re-prioritized or re-estimated along the way.
+def generate_changelog(rng, created, resolved, fields):
+    histories = []
+    status = fields['status']['name']
+    end = resolved or datetime.strptime(fields['updated'], TIMESTAMP_FORMAT)
+    if status != 'Open':
+        started = created + (end - created) / 3
+        histories.append(change(started, 'status', 'Open', 'In Progress'))
+        if resolved and rng.random() < .1:
+            reopened = started + (end - started) / 2
+            histories.append(change(reopened - timedelta(hours=1), 'status', 'In Progress', status))
+            histories.append(change(reopened, 'status', status, 'In Progress'))
+        if resolved:
+            histories.append(change(resolved, 'status', 'In Progress', status))
+        elif status != 'In Progress':
+            histories.append(change(started + timedelta(hours=1), 'status', 'In Progress', status))
+    if rng.random() < .1:
+        priority = weighted_choice(rng, PRIORITIES)
+        histories.append(change(created + (end - created) / 4, 'priority', priority, fields['priority']['name']))
+    points = fields[STORY_POINTS_FIELD]
+    if points and rng.random() < .15:
+        histories.append(change(created + (end - created) / 5, STORY_POINTS_FIELD, str(rng.choice(STORY_POINTS[1:])), str(points)))
+    histories.sort(key=lambda history: history['created'])
+    return {'startAt': 0, 'maxResults': len(histories), 'total': len(histories), 'histories': histories}
+
+def generate_issues(count, seed=0, today=None):
+    """Issues with roughly the shape of a real project: work arrives faster over
+    time, most of it gets done, and older issues are more likely to be done.
+    """
+    rng = random.Random(seed)
+    # Changelogs draw from their own generator, so adding them left the issues unchanged.
+    changelog_rng = random.Random(seed + 1)
+    now = datetime.combine(today or datetime.today().date(), datetime.min.time())
+    start = now - timedelta(days=DAYS_OF_HISTORY)
+    issues = []
+    for number in xrange(1, count + 1):
+        # sqrt skews creation towards recent days, like a growing backlog.
+        age = DAYS_OF_HISTORY * (1 - rng.random() ** .5)
+        created = now - timedelta(days=age, hours=rng.randint(0, 23))
+        created = max(created, start)
+        is_done = rng.random() < min(.95, age / 90.0)
+        resolved = None
+        if is_done:
+            lead_time = timedelta(days=min(age, rng.lognormvariate(2, 1)))
+            resolved = created + lead_time
+        updated = resolved or created + timedelta(days=rng.random() * age)
+        fields = {
+                'issuetype': {'name': weighted_choice(rng, ISSUE_TYPES)},
+                'status': {'name': rng.choice(DONE_STATUSES if is_done else OPEN_STATUSES)},
+                'priority': {'name': weighted_choice(rng, PRIORITIES)},
+                'created': created.strftime(TIMESTAMP_FORMAT),
+                'resolutiondate': resolved and resolved.strftime(TIMESTAMP_FORMAT),
+                'updated': updated.strftime(TIMESTAMP_FORMAT),
+                STORY_POINTS_FIELD: rng.choice(STORY_POINTS),
+                'description': 'Generated issue %i' % number,
+        }
+        issues.append({
+            'key': 'FAKE-%i' % number,
+            'fields': fields,
+            'changelog': generate_changelog(changelog_rng, created, resolved, fields),
+        })
+
+    # Most issues belong to an epic.
+    epic_rng = random.Random(seed + 2)
+    epic_keys = [issue['key'] for issue in issues if issue['fields']['issuetype']['name'] == 'Epic']
+    for issue in issues:
+        if epic_keys and issue['fields']['issuetype']['name'] != 'Epic' and epic_rng.random() < .8:
+            issue['fields'][EPIC_LINK_FIELD] = epic_rng.choice(epic_keys)
+    return issues
+
+def dev_days(weeks, seed=0, today=None):
+    """A projects.yml `dev_days` mapping covering the last `weeks` weeks."""
+    rng = random.Random(seed)
+    today = today or datetime.today().date()
+    monday = today - timedelta(days=today.weekday())
+    return dict(
+        (monday - timedelta(weeks=week), ', '.join(str(rng.randint(2, 6)) for _ in range(5)))
+        for week in range(weeks))
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        start_at = int(params.get('startAt', ['0'])[0])
+        max_results = int(params.get('maxResults', [str(MAX_RESULTS)])[0])
+        if max_results < 0 or max_results > MAX_RESULTS:
+            max_results = MAX_RESULTS
+
+        changelog_key = CHANGELOG_PATH.match(url.path)
+        if changelog_key:
+            issue = self.server.issues_by_key.get(changelog_key.group(1))
+            if not issue:
+                self.send_json(httplib.NOT_FOUND, {'errorMessages': ['Issue does not exist']})
+                return
+            histories = issue['changelog']['histories']
+            self.send_json(httplib.OK, {
+                'startAt': start_at, 'maxResults': max_results, 'total': len(histories),
+                'isLast': start_at + max_results >= len(histories),
+                'values': histories[start_at:start_at + max_results]})
+            return
+        if url.path != '/rest/api/2/search':
+            self.send_error(httplib.NOT_FOUND)
+            return
+
+        issues = self.server.issues
+        jql = params.get('jql', [''])[0]
+        since = UPDATED_SINCE.search(jql)
+        if since:
+            issues = [issue for issue in issues if issue['fields']['updated'][:10] >= since.group(1)]
+        keys = KEY_IN.search(jql)
+        if keys:
+            keys = [key.strip() for key in keys.group(1).split(',')]
+            missing = [key for key in keys if key not in self.server.issues_by_key]
+            # Like Jira, unknown keys fail the whole query unless it is only validated leniently.
+            if missing and params.get('validateQuery', ['strict'])[0] != 'warn':
+                self.send_json(httplib.BAD_REQUEST, {
+                    'errorMessages': ["An issue with key '%s' does not exist for field 'key'." % missing[0]]})
+                return
+            issues = [self.server.issues_by_key[key] for key in keys if key not in missing]
+        page = issues[start_at:start_at + max_results]
+        fields = params['fields'][0].split(',') if 'fields' in params else None
+        with_changelog = 'changelog' in params.get('expand', [''])[0].split(',')
+        page = [self.issue_json(issue, fields, with_changelog) for issue in page]
+
+        self.send_json(httplib.OK, {
+            'startAt': start_at, 'maxResults': max_results,
+            'total': len(issues), 'issues': page})
+
+    def send_json(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.requests += 1
+
+    def issue_json(self, issue, fields, with_changelog):
+        issue_json = {
+            'key': issue['key'],
+            'fields': dict((f, issue['fields'].get(f)) for f in fields) if fields else issue['fields'],
+        }
+        if with_changelog:
+            histories = issue['changelog']['histories']
+            issue_json['changelog'] = {
+                'startAt': 0, 'maxResults': self.server.embedded_changelog_size, 'total': len(histories),
+                'histories': histories[:self.server.embedded_changelog_size]}
+        return issue_json
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeJira(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, issues, port=0, embedded_changelog_size=EMBEDDED_CHANGELOG_SIZE):
+        HTTPServer.__init__(self, ('127.0.0.1', port), SearchHandler)
+        self.issues = issues
+        self.embedded_changelog_size = embedded_changelog_size
+        self.issues_by_key = dict((issue['key'], issue) for issue in issues)
+        self.requests = 0
+
+    @property
+    def hostname(self):
+        return '%s:%i' % self.server_address
+
+    def start(self):
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--issues', type=int, default=1000)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeJira(generate_issues(args.issues, args.seed), args.port)
+    print 'Serving %i issues on http://%s' % (args.issues, server.hostname)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+# Times each stage of the report pipeline against benchmarks/fake_jira.py,
+# so runs can be compared between versions.
+#
+# To run:
+#     `./benchmarks/run_benchmarks.py --sizes 1000 10000 100000 --output bench.json`
+
+
+from argparse import ArgumentParser
+from datetime import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from fake_jira import dev_days, generate_issues, FakeJira, STORY_POINTS_FIELD
+from jira_connect import JIRA
+import project_report
+from utils import created_and_closed_by_date, IssueTable
+
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+QUERY = 'project = FAKE'
+CONFIG = """[server]
+hostname = %(hostname)s
+scheme = http
+
+[user]
+username = benchmark
+password = benchmark
+
+[cache]
+directory = %(cache_directory)s
+
+[jira]
+white_list_priorities =
+done_statuses = [done, closed]
+story_points_field = %(story_points_field)s
+"""
+
+
+def collect_options():
+    parser = ArgumentParser()
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+        help='Numbers of issues per project to benchmark.')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed for the generated issues, so runs are comparable.')
+    parser.add_argument(
+        '--output',
+        help='Write the results as JSON to this file instead of stdout.')
+    return parser.parse_args()
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_inputs(work_dir, hostname, project):
+    config_file = os.path.join(work_dir, 'jira.cfg')
+    with open(config_file, 'w') as f:
+        f.write(CONFIG % {
+            'hostname': hostname,
+            'cache_directory': os.path.join(work_dir, 'cache'),
+            'story_points_field': STORY_POINTS_FIELD,
+        })
+    projects_file = os.path.join(work_dir, 'projects.yml')
+    with open(projects_file, 'w') as f:
+        f.write(yaml.safe_dump([project]))
+    os.mkdir(os.path.join(work_dir, 'cache'))
+    os.mkdir(os.path.join(work_dir, 'graphs'))
+    return config_file, projects_file
+
+def timed(results, size, stage, function, *args):
+    start = time.time()
+    value = function(*args)
+    seconds = time.time() - start
+    results.append({'issues': size, 'stage': stage, 'seconds': round(seconds, 4)})
+    sys.stderr.write('%8i issues  %-28s %8.3fs\n' % (size, stage, seconds))
+    return value
+
+def benchmark(size, seed, results):
+    work_dir = tempfile.mkdtemp(prefix='jira_reports_bench_')
+    server = FakeJira(generate_issues(size, seed)).start()
+    try:
+        project = {'name': 'Benchmark', 'query': QUERY, 'dev_days': dev_days(104, seed)}
+        config_file, projects_file = write_inputs(work_dir, server.hostname, project)
+        jira = JIRA(config_file)
+
+        issues = timed(results, size, 'JIRA.query', lambda: list(jira.query(QUERY)))
+        timed(results, size, 'created_and_closed_by_date', created_and_closed_by_date,
+              issues, jira.high_priorities, jira.done_statuses)
+        table = timed(results, size, 'IssueTable', IssueTable,
+                      issues, jira.done_statuses, jira.story_points_field, ('Epic',))
+        created_by_date, closed_by_date = table.created_and_closed_by_date(jira.high_priorities)
+        timed(results, size, 'collect_time_data', project_report.collect_time_data,
+              created_by_date, closed_by_date)
+        _, points_closed_by_date = table.created_and_closed_by_date(jira.high_priorities, use_story_points=True)
+        timed(results, size, 'graph_daily_rates', project_report.graph_daily_rates,
+              project, points_closed_by_date, os.path.join(work_dir, 'graphs', 'daily-rates.png'))
+
+        with open(os.devnull, 'w') as devnull:
+            command = [sys.executable, os.path.join(REPO_DIR, 'project_report.py'), '-a', config_file, projects_file]
+            timed(results, size, 'all_reports',
+                  lambda: subprocess.check_call(command, stdout=devnull, stderr=devnull, cwd=work_dir))
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(work_dir)
+
+def main():
+    args = collect_options()
+    results = []
+    for size in args.sizes:
+        benchmark(size, args.seed, results)
+
+    report = json.dumps({
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'seed': args.seed,
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print report
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+from collections import defaultdict
+from datetime import date
+import json
+import os
+
+
+class DailySnapshot(object):
+    """Per-day created/closed totals for one project, by priority and done status.
+
+    `rows` maps (date ordinal, priority, done) to
+    [issues created, points created, issues closed, points closed].
+    Reports aggregate straight from the rows, so once a snapshot is saved the
+    graphs can be redrawn without the issue cache.
+
+    Updates are incremental: the contribution each issue made is kept in a
+    separate file, and only issues whose contribution changed are moved.
+    """
+
+    def __init__(self, rows=None, issue_count=0):
+        self.rows = rows or {}
+        self.issue_count = issue_count
+
+    def __len__(self):
+        return self.issue_count
+
+    @property
+    def priorities(self):
+        return sorted(set(priority for _, priority, _ in self.rows))
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, 'r') as f:
+            data = json.loads(f.read())
+        rows = dict(
+            ((ordinal, priority, bool(done)), totals)
+            for ordinal, priority, done, totals in data['rows'])
+        return cls(rows, data['issue_count'])
+
+    def save(self, file_name):
+        rows = [
+            (ordinal, priority, done, totals)
+            for (ordinal, priority, done), totals in self.rows.iteritems()]
+        with open(file_name, 'w') as f:
+            f.write(json.dumps({'issue_count': self.issue_count, 'rows': rows}))
+
+    # contribution: (created ordinal, closed ordinal, priority, points, done)
+    def add(self, contribution, sign):
+        created, closed, priority, points, done = contribution
+        self.issue_count += sign
+        row = self.rows.setdefault((created, priority, done), [0, 0, 0, 0])
+        row[0] += sign
+        row[1] += sign * points
+        if done:
+            row = self.rows.setdefault((closed, priority, done), [0, 0, 0, 0])
+            row[2] += sign
+            row[3] += sign * points
+
+    # Moves the issues whose contribution changed since `contributions` was
+    # recorded, and returns the contributions for `table`.
+    def update(self, table, contributions):
+        current = dict(
+            (key, (created, closed, table.priorities[priority], points, done))
+            for key, created, closed, priority, points, done in zip(
+                table.keys, table.created.tolist(), table.closed.tolist(),
+                table.priority.tolist(), table.points.tolist(), table.done.tolist()))
+
+        for key, contribution in contributions.iteritems():
+            if current.get(key) != contribution:
+                self.add(contribution, -1)
+        for key, contribution in current.iteritems():
+            if contributions.get(key) != contribution:
+                self.add(contribution, 1)
+        self.rows = dict((key, totals) for key, totals in self.rows.iteritems() if any(totals))
+        return current
+
+    # ({date1: num_created, date2: num_created, ...},
+    #  {date1: num_closed, date2: num_closed, ...})
+    def created_and_closed_by_date(self, priority_filter, use_story_points=False):
+        created_index, closed_index = (1, 3) if use_story_points else (0, 2)
+        created_by_date, closed_by_date = defaultdict(int), defaultdict(int)
+        for (ordinal, priority, done), totals in self.rows.iteritems():
+            if priority.lower() in priority_filter:
+                if totals[created_index]:
+                    created_by_date[ordinal] += totals[created_index]
+                if totals[closed_index]:
+                    closed_by_date[ordinal] += totals[closed_index]
+        return (
+            defaultdict(int, ((date.fromordinal(o), n) for o, n in created_by_date.iteritems() if n)),
+            defaultdict(int, ((date.fromordinal(o), n) for o, n in closed_by_date.iteritems() if n)))
+
+
+def snapshot_files(cache, query):
+    return cache.cache_file(query, 'daily.json'), cache.cache_file(query, 'daily-issues.json')
+
+def load_snapshot(cache, query):
+    snapshot_file, _ = snapshot_files(cache, query)
+    if snapshot_file and os.path.isfile(snapshot_file):
+        return DailySnapshot.load(snapshot_file)
+
+# Brings the stored snapshot for `query` up to date with `table` and saves it.
+def update_snapshot(cache, query, table):
+    snapshot_file, contributions_file = snapshot_files(cache, query)
+    assert snapshot_file, 'Snapshots are kept in the [cache] directory, which is not set'
+    snapshot, contributions = DailySnapshot(), {}
+    if os.path.isfile(snapshot_file) and os.path.isfile(contributions_file):
+        snapshot = DailySnapshot.load(snapshot_file)
+        with open(contributions_file, 'r') as f:
+            contributions = dict(
+                (key, tuple(contribution))
+                for key, contribution in json.loads(f.read()).iteritems())
+
+    contributions = snapshot.update(table, contributions)
+    snapshot.save(snapshot_file)
+    with open(contributions_file, 'w') as f:
+        f.write(json.dumps(contributions))
+    return snapshot
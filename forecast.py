@@ -0,0 +1,105 @@
+from datetime import date, timedelta
+import math
+
+import numpy as np
+
+
+DEFAULT_SIMULATIONS = 5000
+DEFAULT_SAMPLE_WEEKS = 12  # how far back to sample daily throughput from
+PERCENTILES = (50, 85, 95)
+FAN_PERCENTILES = (5, 25, 50, 75, 95)
+BLOCK_DAYS = 60  # days simulated at a time
+MAX_DAYS = 3 * 365
+# Fixed, so the same data always gives the same forecast.
+SEED = 0
+
+
+class Forecast(object):
+    """Completion dates from a Monte Carlo simulation of the remaining work.
+
+    `dates` maps each of PERCENTILES to the date by which that share of the
+    simulations had finished, or None if they had not within MAX_DAYS, which
+    is reported as no forecast. `fan_dates` and `fan` give the simulated
+    cumulative work closed, at each of FAN_PERCENTILES, for every day from
+    today up to the last of `dates` that is not None.
+    """
+
+    def __init__(self, dates, fan_dates=(), fan=None):
+        self.dates = dates
+        self.fan_dates = fan_dates
+        self.fan = fan or {}
+
+    def __nonzero__(self):
+        return any(self.dates.itervalues())
+
+    def summary(self):
+        return ', '.join(
+            '%i%% by %s' % (percentile, self.dates[percentile]) if self.dates[percentile]
+            else '%i%%: no forecast' % percentile
+            for percentile in PERCENTILES)
+
+
+def throughput_samples(closed_by_date, dev_days, today, sample_weeks):
+    """What to resample each simulated day from: (daily work closed, None)
+    without dev-days, or (work closed per dev-day, dev-days) with them.
+
+    Dev-days are resampled from the same recent days, weekends included, so
+    the simulations keep the team's usual size and working week.
+    """
+    first = max(today - timedelta(weeks=sample_weeks), min(closed_by_date or [today]))
+    days = [first + timedelta(days=offset) for offset in xrange((today - first).days + 1)]
+    closed = np.array([closed_by_date.get(day, 0) for day in days], dtype=float)
+    if not dev_days:
+        return closed, None
+    devs = np.array([dev_days.get(day, 0) for day in days], dtype=float)
+    worked = devs > 0
+    return closed[worked] / devs[worked], devs
+
+def forecast_completion(closed_by_date, work_left, work_closed=0, dev_days=None, today=None,
+                        sample_weeks=DEFAULT_SAMPLE_WEEKS, simulations=DEFAULT_SIMULATIONS):
+    """Simulates `simulations` futures of resampled daily throughput until
+    `work_left` is closed. `work_closed` is where the fan starts from.
+
+    Simulations run BLOCK_DAYS at a time for all of them at once, until every
+    one has finished or MAX_DAYS have passed.
+    """
+    today = today or date.today()
+    rates, devs = throughput_samples(closed_by_date, dev_days, today, sample_weeks)
+    if work_left <= 0 or not len(rates) or not rates.any() or (devs is not None and not devs.any()):
+        return Forecast(dict((percentile, None) for percentile in PERCENTILES))
+
+    rng = np.random.RandomState(SEED)
+    finished_day = np.full(simulations, np.inf)
+    closed = np.zeros(simulations)
+    fan_blocks = []
+    for start in xrange(0, MAX_DAYS, BLOCK_DAYS):
+        daily = rng.choice(rates, (simulations, BLOCK_DAYS))
+        if devs is not None:
+            daily *= rng.choice(devs, (simulations, BLOCK_DAYS))
+        cumulative = closed[:, np.newaxis] + np.cumsum(daily, axis=1)
+        closed = cumulative[:, -1]
+
+        done = cumulative >= work_left
+        newly_finished = np.isinf(finished_day) & done.any(axis=1)
+        finished_day[newly_finished] = start + 1 + np.argmax(done[newly_finished], axis=1)
+        fan_blocks.append(np.percentile(np.minimum(cumulative, work_left), FAN_PERCENTILES, axis=0))
+        if not np.isinf(finished_day).any():
+            break
+
+    finished_day.sort()
+    dates = {}
+    for percentile in PERCENTILES:
+        day = finished_day[int(math.ceil(percentile / 100.0 * simulations)) - 1]
+        dates[percentile] = None if np.isinf(day) else today + timedelta(days=int(day))
+
+    # Simulations still running at MAX_DAYS would stretch the fan, and the
+    # graph with it, years past anything that was forecast.
+    last_date = max([day for day in dates.itervalues() if day] or [None])
+    if not last_date:
+        return Forecast(dates)
+    fan_values = np.concatenate(fan_blocks, axis=1)[:, :(last_date - today).days]
+    fan_dates = [today] + [today + timedelta(days=offset) for offset in xrange(1, fan_values.shape[1] + 1)]
+    fan = dict(
+        (percentile, [work_closed] + list(work_closed + values))
+        for percentile, values in zip(FAN_PERCENTILES, fan_values))
+    return Forecast(dates, fan_dates, fan)
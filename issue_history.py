@@ -0,0 +1,252 @@
+from array import array
+import glob
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from utils import date_ordinal, story_points, sum_by_date
+
+
+HISTORY_FIELDS = ('status', 'priority', 'points')
+HISTORY_STORE = 'histories.sqlite'
+# Written by earlier versions with whichever dbm module the host had.
+LEGACY_HISTORY_STORE = 'histories.db'
+# Parsed histories are written in batches of this many, each in its own transaction.
+FLUSH_SIZE = 1000
+
+
+# Story points arrive as numbers in fields but as strings like "3.0" in changelogs.
+def parse_points(value):
+    return int(float(value or 0))
+
+def named(value):
+    return value['name'] if value else ''
+
+# The changelog field an item changed, as one of HISTORY_FIELDS, or None.
+def history_field(item, story_points_field):
+    if item['field'] in ('status', 'priority'):
+        return item['field']
+    if story_points_field in (item.get('fieldId'), item['field']):
+        return 'points'
+
+def parse_history(issue, story_points_field):
+    """The states an issue went through, from an issue fetched with its complete
+    changelog.
+
+    Returns {'key', 'updated', 'issuetype', 'created', 'initial', 'changes'}
+    where `initial` is the status, priority and points the issue was created
+    with and `changes` is a list of [date, field, new value], oldest first.
+    Starting values are worked out backwards from the first change to each
+    field, or the current value if it never changed.
+    """
+    fields = issue['fields']
+    current = {
+        'status': named(fields['status']),
+        'priority': named(fields['priority']),
+        'points': story_points(issue, story_points_field) if story_points_field else 0,
+    }
+    events = []
+    for history in issue.get('changelog', {}).get('histories', []):
+        for item in history['items']:
+            field = history_field(item, story_points_field)
+            if field:
+                events.append((history['created'], field, item.get('fromString'), item.get('toString')))
+    events.sort()
+
+    initial = dict(current)
+    for field in HISTORY_FIELDS:
+        first_change = next((event for event in events if event[1] == field), None)
+        if first_change:
+            initial[field] = first_change[2] or ''
+    initial['points'] = parse_points(initial['points'])
+
+    changes = [
+        [timestamp[:10], field, parse_points(to_value) if field == 'points' else to_value or '']
+        for timestamp, field, _, to_value in events]
+    return {
+        'key': issue['key'],
+        'updated': fields['updated'],
+        'issuetype': named(fields['issuetype']),
+        'created': fields['created'][:10],
+        'initial': initial,
+        'changes': changes,
+    }
+
+
+class HistoryStore(object):
+    """Parsed issue histories kept in a SQLite file in the cache directory,
+    keyed by issue key.
+
+    Each entry remembers the `updated` timestamp it was parsed from, so an
+    issue only has to be fetched and parsed again once it changes. The store
+    bounds itself rather than being evicted with the cached queries, which
+    could delete it while it is open: entries of issues that no query has
+    returned for `max_idle` seconds are deleted, and then the least recently
+    seen ones until the histories take up no more than `max_size` bytes.
+    """
+
+    def __init__(self, directory, max_idle=None, max_size=None):
+        self.db = None
+        self.max_idle = max_idle
+        self.max_size = max_size
+        self.seen_keys = []
+        self.pending = []
+        if directory:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for file_name in glob.glob(os.path.join(directory, LEGACY_HISTORY_STORE + '*')):
+                os.remove(file_name)
+            self.db = sqlite3.connect(os.path.join(directory, HISTORY_STORE), timeout=60)
+            with self.db:
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS histories '
+                    '(key TEXT PRIMARY KEY, updated TEXT, last_seen REAL, history TEXT)')
+
+    def get(self, key, updated):
+        if self.db is not None:
+            row = self.db.execute('SELECT updated, history FROM histories WHERE key = ?', (key,)).fetchone()
+            if row and row[0] == updated:
+                self.seen_keys.append(key)
+                return json.loads(row[1])
+
+    def put(self, history):
+        if self.db is not None:
+            self.pending.append((history['key'], history['updated'], time.time(), json.dumps(history)))
+            if len(self.pending) >= FLUSH_SIZE:
+                self.flush()
+
+    def flush(self):
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO histories (key, updated, last_seen, history) VALUES (?, ?, ?, ?)',
+                self.pending)
+        self.pending = []
+
+    # Writes what is left, marks the histories read this run as seen and
+    # deletes those of issues that have not been seen for too long, or for
+    # the longest, if the store has grown too big.
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            now = time.time()
+            with self.db:
+                self.db.executemany(
+                    'UPDATE histories SET last_seen = ? WHERE key = ?', ((now, key) for key in self.seen_keys))
+                if self.max_idle:
+                    self.db.execute('DELETE FROM histories WHERE last_seen < ?', (now - self.max_idle,))
+                if self.max_size:
+                    self.db.executemany('DELETE FROM histories WHERE key = ?', self.oversized_keys())
+            self.db.close()
+
+    # The least recently seen keys whose histories take the store over max_size.
+    def oversized_keys(self):
+        total = self.db.execute('SELECT COALESCE(SUM(LENGTH(history)), 0) FROM histories').fetchone()[0]
+        excess = total - self.max_size
+        keys = []
+        if excess > 0:
+            for key, size in self.db.execute('SELECT key, LENGTH(history) FROM histories ORDER BY last_seen').fetchall():
+                if excess <= 0:
+                    break
+                keys.append((key,))
+                excess -= size
+        return keys
+
+# Yields the history of each issue, from the store where the issue has not
+# been updated since, and otherwise fetched with its changelog and parsed.
+def issue_histories(jira, issues):
+    store = HistoryStore(jira.cache_directory, jira.cache.max_idle, jira.cache.max_size)
+    try:
+        stale_keys = []
+        for issue in issues:
+            history = store.get(issue['key'], issue['fields']['updated'])
+            if history:
+                yield history
+            else:
+                stale_keys.append(issue['key'])
+        for issue in jira.fetch_changelogs(stale_keys):
+            history = parse_history(issue, jira.story_points_field)
+            store.put(history)
+            yield history
+    finally:
+        store.close()
+
+
+class HistoryTable(object):
+    """Issues as the sequence of states they went through, for reports that
+    follow reopened issues, priority changes and re-estimates.
+
+    Holds one row per issue per state: the issue's index, the date the state
+    began, and its priority code, points and done status from that date on.
+    Rows of an issue are consecutive and in date order. Reports aggregate the
+    same way as from an IssueTable, except that created and closed totals can
+    go down as well as up, e.g. when an issue is reopened.
+    """
+
+    def __init__(self, histories, done_statuses, exclude_types=()):
+        self.keys = []
+        self.priorities = []
+        priority_codes = {}
+        ordinals = {}
+        done_by_status = {}
+
+        issue, day, points = array('i'), array('i'), array('i')
+        done, priority = array('b'), array('i')
+        for history in histories:
+            if history['issuetype'] in exclude_types:
+                continue
+            index = len(self.keys)
+            self.keys.append(history['key'])
+
+            state = dict(history['initial'])
+            states = [(history['created'], dict(state))]
+            for changed_on, field, value in history['changes']:
+                state[field] = value
+                states.append((changed_on, dict(state)))
+
+            for date_string, state in states:
+                status = state['status']
+                is_done = done_by_status.get(status)
+                if is_done is None:
+                    is_done = done_by_status[status] = status.lower() in done_statuses
+
+                code = priority_codes.get(state['priority'])
+                if code is None:
+                    code = priority_codes[state['priority']] = len(self.priorities)
+                    self.priorities.append(state['priority'])
+
+                issue.append(index)
+                day.append(date_ordinal(date_string, ordinals))
+                points.append(state['points'])
+                done.append(is_done)
+                priority.append(code)
+
+        self.issue = np.array(issue, dtype=np.int32)
+        self.day = np.array(day, dtype=np.int32)
+        self.points = np.array(points, dtype=np.int32)
+        self.done = np.array(done, dtype=bool)
+        self.priority = np.array(priority, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    # How much each row changes a per-issue value from the row before it.
+    def changes(self, values):
+        previous = np.zeros_like(values)
+        previous[1:] = values[:-1]
+        first_rows = np.ones(len(values), dtype=bool)
+        first_rows[1:] = self.issue[1:] != self.issue[:-1]
+        previous[first_rows] = 0
+        return values - previous
+
+    # ({date1: net created, date2: net created, ...},
+    #  {date1: net closed, date2: net closed, ...})
+    def created_and_closed_by_date(self, priority_filter, use_story_points=False):
+        allowed = np.array([name.lower() in priority_filter for name in self.priorities], dtype=bool)
+        values = self.points if use_story_points else np.ones(len(self.issue), dtype=np.int32)
+        counted = np.where(allowed[self.priority], values, 0)
+        closed = np.where(self.done, counted, 0)
+        return (sum_by_date(self.day, self.changes(counted)),
+                sum_by_date(self.day, self.changes(closed)))
@@ -7,18 +7,28 @@
 #     `sudo pip install requests`
 
 
+from collections import deque, OrderedDict
 from ConfigParser import ConfigParser
+from datetime import datetime, timedelta
 import httplib
-import json
-import os
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 import re
-from sha import sha
+from threading import Lock
+import time
 import urllib
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from metrics import Metrics
+from query_cache import QueryCache
+from utils import NAMED_FIELDS, REPORT_FIELDS
 
 
 VERBOSE = False
+ORDER_BY = re.compile(r'\s+order\s+by\s+', re.IGNORECASE)
 
 
 def print_verbose(string):
@@ -26,14 +36,118 @@ def print_verbose(string):
         print(string)
 
 
+def config_get(config, section, option, default=None):
+    if config.has_option(section, option):
+        return config.get(section, option)
+    return default
+
+
+# Restricts a JQL query with an extra clause, keeping any ORDER BY at the end.
+def add_jql_clause(query, clause):
+    parts = ORDER_BY.split(query, 1)
+    restricted = '(%s) AND %s' % (parts[0], clause)
+    if len(parts) > 1:
+        restricted += ' ORDER BY %s' % parts[1]
+    return restricted
+
+
+# Config lists may be written as `[done, closed]` or `done, closed`.
+def parse_config_list(value):
+    return [item.strip() for item in value.strip().strip('[]').split(',') if item.strip()]
+
+
+# Statuses and priorities are matched exactly but case-insensitively, so they
+# are kept lower-cased in a set.
+def parse_config_names(value):
+    return frozenset(item.lower() for item in parse_config_list(value))
+
+
+# Keeps only the fields the reports read, so the cache stays small.
+def slim_issue(issue, fields):
+    issue_fields = issue['fields']
+    slim_fields = {}
+    for field in fields:
+        value = issue_fields.get(field)
+        if field in NAMED_FIELDS and value:
+            value = {'name': value['name']}
+        elif isinstance(value, dict) and 'key' in value:
+            # Links to other issues, like an epic `parent`, only need the key.
+            value = {'key': value['key']}
+        slim_fields[field] = value
+    return {'key': issue['key'], 'fields': slim_fields}
+
+
+# Like pool.imap, but with at most `window` calls in flight, so results are
+# not fetched much faster than they are read.
+def bounded_imap(pool, function, items, window):
+    items = iter(items)
+    in_flight = deque(pool.apply_async(function, (item,)) for item in islice(items, window))
+    while in_flight:
+        result = in_flight.popleft().get()
+        in_flight.extend(pool.apply_async(function, (item,)) for item in islice(items, 1))
+        yield result
+
+
 class ContainsEverything(object):
     def __contains__(self, value):
         return True
 
 
+# Caps how many requests a run may make, however many threads share it.
+class RequestBudget(object):
+    def __init__(self, max_requests=None):
+        self.max_requests = max_requests
+        self.spent = 0
+        self.lock = Lock()
+
+    def spend(self):
+        with self.lock:
+            self.spent += 1
+            assert not self.max_requests or self.spent <= self.max_requests, \
+                'Used up the budget of %i requests to JIRA ([server] max_requests)' % self.max_requests
+
+
+# urllib3 resends a retried request itself, so each retry is charged to the
+# budget here rather than in get_with_auth.
+class BudgetedRetry(Retry):
+    def __init__(self, budget=None, **kwargs):
+        Retry.__init__(self, **kwargs)
+        self.budget = budget
+
+    def new(self, **kwargs):
+        retry = Retry.new(self, **kwargs)
+        retry.budget = self.budget
+        return retry
+
+    # Only charges once a retry is certain to be sent: increment raises
+    # instead when the retries are used up.
+    def increment(self, *args, **kwargs):
+        retry = Retry.increment(self, *args, **kwargs)
+        if self.budget:
+            self.budget.spend()
+        return retry
+
+
 class JIRA(object):
-    SEARCH_API = 'https://%s/rest/api/2/search?maxResults=-1&jql='
+    SEARCH_API = '%s://%s/rest/api/2/search'
+    CHANGELOG_API = '%s://%s/rest/api/2/issue/%s/changelog'
     BAD_HOSTNAME = re.compile('https?:\/\/')
+    # Jira Cloud caps each search page at 50-100 issues regardless of what we ask for.
+    DEFAULT_PAGE_SIZE = 100
+    DEFAULT_MAX_CONCURRENCY = 4
+    # Connections kept alive to the server, shared by every fetching thread.
+    DEFAULT_POOL_SIZE = 16
+    DEFAULT_MAX_RETRIES = 5
+    # Retries wait backoff_factor * 2^(attempt - 1) seconds, or as long as Retry-After asks.
+    DEFAULT_BACKOFF_FACTOR = 1
+    DEFAULT_TIMEOUT = 60
+    RETRY_STATUSES = (
+        requests.codes.too_many_requests, requests.codes.internal_server_error, requests.codes.bad_gateway,
+        requests.codes.service_unavailable, requests.codes.gateway_timeout)
+    # Deleted issues never show up in an `updated` delta, so refetch everything this often.
+    DEFAULT_FULL_SYNC_DAYS = 7
+    # Changelog fetches are recorded in the metrics under this name.
+    CHANGELOGS = 'changelogs'
 
     def __init__(self, config_file):
         config = ConfigParser()
@@ -41,48 +155,226 @@ class JIRA(object):
 
         self.hostname = config.get('server', 'hostname')
         assert not self.BAD_HOSTNAME.match(self.hostname), 'Hostname in config should not start with "http"'
-        self.search_api = self.SEARCH_API % self.hostname
+        # Only a local stand-in like benchmarks/fake_jira.py should need http.
+        self.scheme = config_get(config, 'server', 'scheme') or 'https'
+        self.search_api = self.SEARCH_API % (self.scheme, self.hostname)
+        self.page_size = int(config_get(config, 'server', 'page_size') or self.DEFAULT_PAGE_SIZE)
+        self.max_concurrency = int(config_get(config, 'server', 'max_concurrency') or self.DEFAULT_MAX_CONCURRENCY)
+        self.pool_size = int(config_get(config, 'server', 'pool_size') or self.DEFAULT_POOL_SIZE)
+        self.max_retries = int(config_get(config, 'server', 'max_retries') or self.DEFAULT_MAX_RETRIES)
+        self.backoff_factor = float(config_get(config, 'server', 'backoff_factor') or self.DEFAULT_BACKOFF_FACTOR)
+        self.timeout = float(config_get(config, 'server', 'timeout') or self.DEFAULT_TIMEOUT)
+        self.budget = RequestBudget(int(config_get(config, 'server', 'max_requests') or 0))
 
         self.username = config.get('user', 'username')
         self.password = config.get('user', 'password')
 
         self.cache_directory = config.get('cache', 'directory')
+        self.full_sync_days = float(config_get(config, 'cache', 'full_sync_days') or self.DEFAULT_FULL_SYNC_DAYS)
+        self.cache = QueryCache(
+            self.cache_directory,
+            max_age_hours=float(config_get(config, 'cache', 'max_age_hours') or 0),
+            max_idle_days=float(config_get(config, 'cache', 'max_idle_days') or 0),
+            max_size_mb=float(config_get(config, 'cache', 'max_size_mb') or 0))
 
-        self.high_priorities = config.get('jira', 'white_list_priorities') or ContainsEverything()
-        self.done_statuses = config.get('jira', 'done_statuses')
+        self.white_list_priorities = parse_config_list(config.get('jira', 'white_list_priorities'))
+        self.high_priorities = parse_config_names(config.get('jira', 'white_list_priorities')) or ContainsEverything()
+        self.done_statuses = parse_config_names(config.get('jira', 'done_statuses'))
         self.story_points_field = config.get('jira', 'story_points_field')
+        self.epic_link_field = config_get(config, 'jira', 'epic_link_field')
+        self.fields = list(REPORT_FIELDS)
+        for field in (self.story_points_field, self.epic_link_field):
+            if field:
+                self.fields.append(field)
+
+        self.session = self.make_session()
+        self.metrics = Metrics()
 
-        self.session = requests.session()
+    # One keep-alive session for the whole run. Requests already asks for gzip,
+    # so it only needs a pool big enough for every fetching thread and retries
+    # for rate limiting and transient server errors.
+    def make_session(self):
+        retry = BudgetedRetry(
+            budget=self.budget,
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            respect_retry_after_header=True,
+            raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.session()
+        session.mount('%s://' % self.scheme, adapter)
+        return session
 
-    def cache_file(self, query):
-        if self.cache_directory:
-            hash_value = sha(query).hexdigest()
-            file_name = '%s.cached.json' % hash_value
-            return os.path.join(self.cache_directory, file_name)
+    # Lets Jira drop Epics and non-whitelisted priorities, so they are never
+    # transferred, parsed or cached.
+    def server_filtered_query(self, query):
+        clause = 'issuetype != Epic'
+        if self.white_list_priorities:
+            clause += ' AND priority in (%s)' % ', '.join('"%s"' % p for p in self.white_list_priorities)
+        return add_jql_clause(query, clause)
 
     def get_with_auth(self, url):
-        result = self.session.get(url, auth=(self.username, self.password))        
+        self.budget.spend()
+        result = self.session.get(url, auth=(self.username, self.password), timeout=self.timeout)
         assert result.status_code == httplib.OK, 'URL %s got status: %s\n%s' % (url, result.status_code, result.content)
         return result
 
-    def query(self, query, use_cache=False):
-        cache_file = self.cache_file(query)
-        if use_cache and os.path.isfile(cache_file):
+    # `validate_query='warn'` makes Jira skip values that don't exist, like
+    # the keys of deleted issues, instead of failing the whole query.
+    def search_url(self, query, start_at, expand=None, validate_query=None):
+        url = '%s?jql=%s&startAt=%i&maxResults=%i&fields=%s' % (
+            self.search_api, urllib.quote(query), start_at, self.page_size, ','.join(self.fields))
+        if expand:
+            url += '&expand=%s' % expand
+        if validate_query:
+            url += '&validateQuery=%s' % validate_query
+        return url
+
+    # Page timings and sizes are recorded under `metrics_query`, so a sync's
+    # delta query counts towards the query it syncs.
+    def fetch_page(self, query, start_at, metrics_query=None, expand=None, validate_query=None):
+        query_url = self.search_url(query, start_at, expand, validate_query)
+        start = time.time()
+        result = self.get_with_auth(query_url)
+        self.metrics.add_page(metrics_query or query, time.time() - start, len(result.content))
+        data = result.json()
+        try:
+            data['issues']
+        except:
+            print('ERRORS with URL: %s' % query_url)
+            print('\n'.join(data['errorMessages']))
+            raise
+        for warning in data.get('warningMessages', []):
+            print_verbose('WARNING: %s' % warning)
+        return data
+
+    # Reads `total` from the first page, then fetches the remaining pages concurrently
+    # and yields each page's issues in order. Only max_concurrency pages are
+    # fetched ahead of the one being read, so memory does not grow with the query.
+    def iter_pages(self, query, metrics_query=None, expand=None, validate_query=None):
+        first_page = self.fetch_page(query, 0, metrics_query, expand, validate_query)
+        page_size = len(first_page['issues'])
+        total = first_page.get('total', page_size)
+        yield first_page['issues']
+        if not page_size or page_size >= total:
+            return
+
+        start_ats = xrange(page_size, total, page_size)
+        pool = ThreadPool(min(self.max_concurrency, len(start_ats)))
+        try:
+            fetch = lambda start_at: self.fetch_page(query, start_at, metrics_query, expand, validate_query)
+            for page in bounded_imap(pool, fetch, start_ats, self.max_concurrency):
+                yield page['issues']
+        finally:
+            pool.close()
+
+    # Yields the slimmed issues one at a time. An issue that shifts across a
+    # page boundary while we are paging is only kept once.
+    def iter_issues(self, query, metrics_query=None):
+        seen_keys = set()
+        for page in self.iter_pages(query, metrics_query):
+            for issue in page:
+                if issue['key'] not in seen_keys:
+                    seen_keys.add(issue['key'])
+                    yield slim_issue(issue, self.fields)
+        print_verbose('FETCHED %i issues' % len(seen_keys))
+        self.metrics.query(metrics_query or query)['issues_fetched'] += len(seen_keys)
+
+    def fetch_all(self, query, metrics_query=None):
+        return list(self.iter_issues(query, metrics_query))
+
+    # Every history of an issue, a page at a time.
+    def fetch_changelog(self, key):
+        histories = []
+        while True:
+            url = '%s?startAt=%i&maxResults=%i' % (
+                self.CHANGELOG_API % (self.scheme, self.hostname, urllib.quote(key)), len(histories), self.page_size)
+            start = time.time()
+            result = self.get_with_auth(url)
+            self.metrics.add_page(self.CHANGELOGS, time.time() - start, len(result.content))
+            page = result.json()
+            histories.extend(page['values'])
+            if page.get('isLast') or not page['values'] or len(histories) >= page.get('total', 0):
+                return histories
+
+    # Yields the issues with these keys along with their complete changelogs,
+    # fetching a page of keys per query. Keys of issues deleted since are skipped.
+    def fetch_changelogs(self, keys):
+        def fetch(batch):
+            query = 'key in (%s)' % ', '.join(batch)
+            issues = [
+                issue for page in self.iter_pages(query, self.CHANGELOGS, 'changelog', validate_query='warn')
+                for issue in page]
+            # Search results only embed the first page of each changelog.
+            for issue in issues:
+                changelog = issue.get('changelog', {})
+                if changelog.get('total', 0) > len(changelog.get('histories', [])):
+                    changelog['histories'] = self.fetch_changelog(issue['key'])
+            return issues
+
+        batches = [keys[start:start + self.page_size] for start in xrange(0, len(keys), self.page_size)]
+        if not batches:
+            return
+        pool = ThreadPool(min(self.max_concurrency, len(batches)))
+        try:
+            for issues in bounded_imap(pool, fetch, batches, self.max_concurrency):
+                for issue in issues:
+                    yield issue
+        finally:
+            pool.close()
+
+    def can_sync(self, query):
+        if not self.cache.has(query):
+            return False
+        meta = self.cache.meta(query)
+        age_days = (time.time() - meta['last_full_sync']) / (24 * 60 * 60)
+        return bool(meta['updated']) and age_days < self.full_sync_days
+
+    # Fetches only the issues updated since the last sync and merges them by key
+    # into the cached issues as those are read back.
+    def sync(self, query):
+        meta = self.cache.meta(query)
+        # JQL compares dates in the user's time zone while `updated` carries the
+        # server's offset. Going back a day covers the difference; merging by key
+        # makes the overlap harmless.
+        newest = datetime.strptime(meta['updated'][:10], '%Y-%m-%d').date()
+        since = (newest - timedelta(days=1)).strftime('%Y-%m-%d')
+        delta_query = add_jql_clause(query, 'updated >= "%s"' % since)
+        print_verbose('SYNCING JIRA: %s' % delta_query)
+        changed = OrderedDict(
+            (issue['key'], issue) for issue in self.fetch_all(delta_query, metrics_query=query))
+        print_verbose('SYNCED %i changed issues' % len(changed))
+
+        def merged():
+            for issue in self.cache.read(query):
+                yield changed.pop(issue['key'], issue)
+            for issue in changed.itervalues():
+                yield issue
+        return self.cache.write_through(query, merged(), meta['last_full_sync'])
+
+    # Returns an iterable of issues. Cache hits are decoded lazily from disk.
+    # With `stream`, fetched issues are also only fetched, cached and handed on
+    # as the caller iterates, so they never all have to be in memory at once.
+    def query(self, query, use_cache=False, incremental=False, stream=False):
+        start = time.time()
+        if use_cache and self.cache.is_fresh(query):
+            result = 'hit'
+            self.cache.record(query, result)
             print('FETCHING FROM CACHE: %s' % query)
-            with open(cache_file, 'r') as f:
-                raw_json = f.read()
-                issues = json.loads(raw_json)
+            issues = self.cache.read(query)
+        elif incremental and self.can_sync(query):
+            result = 'sync'
+            self.cache.record(query, result)
+            issues = self.sync(query)
         else:
+            result = 'stale' if use_cache and self.cache.has(query) else 'miss'
+            self.cache.record(query, result)
             print_verbose('QUERYING JIRA: %s' % query)
-            query_url = self.search_api + urllib.quote(query)
-            result = self.get_with_auth(query_url)
-            data = result.json()
-            try:
-                issues = data['issues']
-                with open(cache_file, 'w') as f:
-                    f.write(json.dumps(issues))
-            except:
-                print('ERRORS with URL: %s' % query_url)
-                print('\n'.join(data['errorMessages']))
-                raise
+            issues = self.cache.write_through(query, self.iter_issues(query), time.time())
+        if not stream and result != 'hit':
+            issues = list(issues)
+        stats = self.metrics.query(query)
+        stats['cache'] = result
+        stats['seconds'] += time.time() - start
         return issues
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import resource
+import sys
+from threading import Lock
+import time
+
+
+PROMETHEUS_PREFIX = 'jira_reports'
+
+
+# Adds the time spent in the block to `timings[stage]`. Takes a plain dict so
+# it also works in worker processes, which hand their timings back.
+@contextmanager
+def timer(timings, stage):
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.time() - start
+
+# Peak resident memory in bytes, of this process or of its largest child.
+def peak_memory(who=resource.RUSAGE_SELF):
+    max_rss = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+def prometheus_labels(**labels):
+    def escape(value):
+        return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join('%s="%s"' % (name, escape(value)) for name, value in sorted(labels.iteritems()))
+
+
+class Metrics(object):
+    """Timings and counters for one run, to find which projects and stages are slow.
+
+    `queries` holds, per JQL query, how the cache served it and the HTTP
+    requests made for it. `projects` holds the seconds each project spent in
+    each stage, and `stages` the same for steps that cover the whole run.
+    Hits are read lazily from the cache, and with --stream so are fetches, so
+    that time shows up in the project's `aggregate` stage rather than under
+    the query.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.queries = OrderedDict()
+        self.projects = OrderedDict()
+        self.stages = OrderedDict()
+        self.lock = Lock()
+
+    def query(self, query):
+        with self.lock:
+            if query not in self.queries:
+                self.queries[query] = OrderedDict([
+                    ('cache', None), ('seconds', 0.0), ('issues_fetched', 0),
+                    ('pages', 0), ('http_seconds', 0.0), ('bytes', 0)])
+            return self.queries[query]
+
+    def add_page(self, query, seconds, size):
+        stats = self.query(query)
+        with self.lock:
+            stats['pages'] += 1
+            stats['http_seconds'] += seconds
+            stats['bytes'] += size
+
+    def add_timings(self, project_name, timings):
+        with self.lock:
+            stages = self.projects.setdefault(project_name, OrderedDict())
+            for stage, seconds in timings.iteritems():
+                stages[stage] = stages.get(stage, 0) + seconds
+
+    def stage(self, stage):
+        return timer(self.stages, stage)
+
+    # Stops the run's clock, for metrics that are kept around after the run.
+    def finish(self):
+        self.finished = time.time()
+
+    def summary(self):
+        def rounded(stages):
+            return OrderedDict((stage, round(seconds, 4)) for stage, seconds in stages.iteritems())
+        queries = OrderedDict()
+        for query, stats in self.queries.iteritems():
+            queries[query] = OrderedDict(stats)
+            queries[query]['seconds'] = round(stats['seconds'], 4)
+            queries[query]['http_seconds'] = round(stats['http_seconds'], 4)
+        return OrderedDict([
+            ('started', self.started),
+            ('seconds', round((self.finished or time.time()) - self.started, 4)),
+            ('peak_memory_bytes', peak_memory()),
+            ('peak_worker_memory_bytes', peak_memory(resource.RUSAGE_CHILDREN)),
+            ('stages', rounded(self.stages)),
+            ('queries', queries),
+            ('projects', OrderedDict(
+                (name, rounded(stages)) for name, stages in self.projects.iteritems())),
+        ])
+
+    def write_json(self, file_name):
+        with open(file_name, 'w') as f:
+            f.write(json.dumps(self.summary(), indent=2))
+
+    # The metrics in Prometheus' text exposition format.
+    def prometheus(self):
+        summary = self.summary()
+        metrics = OrderedDict()
+
+        def add(name, help_text, value, **labels):
+            samples = metrics.setdefault(name, (help_text, []))[1]
+            samples.append((prometheus_labels(**labels), value))
+
+        add('last_run_timestamp_seconds', 'When the run started.', summary['started'])
+        add('run_seconds', 'Wall time of the whole run.', summary['seconds'])
+        add('peak_memory_bytes', 'Peak resident memory.', summary['peak_memory_bytes'], process='main')
+        add('peak_memory_bytes', 'Peak resident memory.', summary['peak_worker_memory_bytes'], process='worker')
+        for stage, seconds in summary['stages'].iteritems():
+            add('stage_seconds', 'Time spent in steps that cover the whole run.', seconds, stage=stage)
+        for query, stats in summary['queries'].iteritems():
+            add('query_cache', 'How the cache served each query.', 1, query=query, result=stats['cache'])
+            add('query_seconds', 'Time spent fetching and syncing each query.', stats['seconds'], query=query)
+            add('query_issues_fetched', 'Issues fetched from JIRA for each query.', stats['issues_fetched'], query=query)
+            add('query_pages', 'Search pages fetched for each query.', stats['pages'], query=query)
+            add('query_http_seconds', 'Time spent in HTTP requests for each query, summed over pages.', stats['http_seconds'], query=query)
+            add('query_bytes', 'Response bytes received for each query.', stats['bytes'], query=query)
+        for project_name, stages in summary['projects'].iteritems():
+            for stage, seconds in stages.iteritems():
+                add('project_seconds', 'Time each project spent in each stage.', seconds, project=project_name, stage=stage)
+
+        lines = []
+        for name, (help_text, samples) in metrics.iteritems():
+            name = '%s_%s' % (PROMETHEUS_PREFIX, name)
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s gauge' % name)
+            lines.extend('%s{%s} %s' % (name, labels, value) if labels else '%s %s' % (name, value)
+                         for labels, value in samples)
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    # Written for node_exporter's textfile collector, which may read the file
+    # at any time, so it is only renamed into place once complete.
+    def write_prometheus(self, file_name):
+        partial_file_name = '%s.partial' % file_name
+        with open(partial_file_name, 'w') as f:
+            f.write(self.prometheus())
+        os.rename(partial_file_name, file_name)
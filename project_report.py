@@ -3,40 +3,44 @@
 # The following Python libraries are required to run this script.
 # http://docs.python-requests.org/en/master/
 # http://matplotlib.org/
+# http://www.numpy.org/
 # http://pyyaml.org/
 #
 # To install:
 #     `sudo pip install requests`
 #     `sudo pip install matplotlib`
+#     `sudo pip install numpy`
 #     `sudo pip install pyyaml`
 
 
 from argparse import ArgumentParser
-from collections import defaultdict, deque
-from datetime import date, timedelta
-from itertools import chain
+from collections import defaultdict, OrderedDict
+from datetime import date
+from itertools import chain, cycle, imap
 import math
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 import os
 
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
-import matplotlib.ticker as plticker
-
-from utils import created_and_closed_by_date, devs_per_day, load_projects, DATE_FORMAT, PROJECTS_FILE
+from utils import devs_per_day, load_projects, IssueTable, DATE_FORMAT, PROJECTS_FILE
+from daily_snapshot import load_snapshot, update_snapshot
+from forecast import forecast_completion, DEFAULT_SAMPLE_WEEKS, MAX_DAYS
+from issue_history import issue_histories, HistoryTable
+import rendering
 from jira_connect import JIRA
+from metrics import timer
+from query_planner import filter_issues, plan_queries
 
 
 BAR_WIDTH = 0.7  # for bar charts
+BREAKDOWNS = ('epic', 'priority')
+DEFAULT_RATE_WEEKS = (4, 2, 1)  # rolling windows on the daily rates graph
 GRAPH_COLORS = {-2: '#ff7043', -1: '#dddddd', 0: '#99bad7', 1: '#6a93b9', 2: '#2a5e8d', 3: '#073763', 4: '#011a30', 5: '#33cc33'}
 GRAPH_LABELS = {-2: 'New This Week', -1: 'Remain Last Week', 0: 'Done This Week', 1: '1 Week Ago', 2: '2 Weeks Ago', 3: '3 Weeks Ago', 4: '4 Weeks Ago'}
 GRAPH_DIR = 'graphs'
 GRID_WIDTH = 20
 
-MONTHS = mdates.MonthLocator()
-MONTHS_FORMAT = mdates.DateFormatter('')
 ONE_WEEK = 7
-WEEKS = mdates.DayLocator(interval=7)
-WEEKS_FORMAT = mdates.DateFormatter('%b\n%-d')
 
 
 def collect_options():
@@ -51,8 +55,56 @@ def collect_options():
     parser.add_argument(
         '-c', '--use-cache', action='store_true',
         help='Used cached JIRA data to avoid making live queries. Useful for testing')
+    parser.add_argument(
+        '-i', '--incremental', action='store_true',
+        help='Only fetch issues updated since the last run and merge them into the cache.')
+    parser.add_argument(
+        '-s', '--server-filter', action='store_true',
+        help='Exclude Epics and non-whitelisted priorities in the JQL query instead of after fetching.')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Fetch and report on this many projects at the same time.')
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='Cache and aggregate issues as each search page arrives instead of holding them all in memory. '
+             'Queries are then fetched one at a time, even with --jobs.')
+    parser.add_argument(
+        '--cache-stats', action='store_true',
+        help='Print whether each query was served from the cache, and how old the data was.')
+    parser.add_argument(
+        '--format', choices=rendering.OUTPUT_FORMATS, default=rendering.OUTPUT_FORMAT,
+        help='File format for the graphs. svg and pdf skip rasterizing.')
+    parser.add_argument(
+        '--dpi', type=int,
+        help='Resolution for png graphs, e.g. 50 for quick previews.')
+    parser.add_argument(
+        '--snapshots', action='store_true',
+        help='Keep per-project daily totals in the cache directory and report from them.')
+    parser.add_argument(
+        '--from-snapshots', action='store_true',
+        help='Report from the saved daily totals without querying JIRA or reading the issue cache.')
+    parser.add_argument(
+        '--metrics',
+        help='Write a JSON summary of timings, HTTP traffic and memory for the run to this file.')
+    parser.add_argument(
+        '--prometheus',
+        help='Write the run metrics to this file, for node_exporter\'s textfile collector.')
+    parser.add_argument(
+        '--history', action='store_true',
+        help='Rebuild each day\'s status, priority and points from the issue changelogs, '
+             'so reopened and re-estimated issues are counted as they were at the time.')
 
-    return parser.parse_args()
+    parser.add_argument(
+        '--breakdown', action='append', choices=BREAKDOWNS,
+        help='Also report on each epic or priority within every project. May be given twice. '
+             'Epics need epic_link_field in the config.')
+
+    args = parser.parse_args()
+    if args.history and (args.snapshots or args.from_snapshots):
+        parser.error('--history cannot be combined with --snapshots or --from-snapshots')
+    if 'epic' in (args.breakdown or ()) and (args.history or args.snapshots or args.from_snapshots):
+        parser.error('--breakdown epic needs the issues, so cannot be combined with --history or snapshots')
+    return args
 
 def prompt_for_choices(choices, choice_names, prompt):
     numbers_to_choices = {str(n): choice for n, choice in enumerate(choices, 1)}
@@ -79,7 +131,7 @@ def graph_file(graph_type):
     def name2file(string):
         return string.replace(' ', '-').lower()
     date_string = date.today().strftime(DATE_FORMAT)
-    file_name = name2file('%s_%s.png' % (graph_type, date_string))
+    file_name = name2file('%s_%s.%s' % (graph_type, date_string, rendering.OUTPUT_FORMAT))
     return os.path.join(GRAPH_DIR, file_name)
 
 def get_date_list(created_data, closed_data, max_date):
@@ -91,13 +143,16 @@ def get_date_list(created_data, closed_data, max_date):
         date.fromordinal(ordinal)
         for ordinal in xrange(min_date.toordinal(), max_date.toordinal() + 1)]
 
-def graph_time_data(created_data, closed_data, title, file_name, y_label):
+def graph_time_data(created_data, closed_data, title, file_name, y_label, forecast=None):
     today = date.fromordinal(date.today().toordinal())
     date_list = get_date_list(created_data, closed_data, today)
 
+    # The rate sample starts with the first recorded event. collect_time_data
+    # used to fill closed_data with every day of the history before this ran,
+    # so that is what min(closed_data) has always returned here.
     first_work_date = None
     if closed_data:
-        first_work_date = min(closed_data.iterkeys())
+        first_work_date = date_list[0]
 
     created_series, closed_series = [], []
     cumulative_created, cumulative_closed = 0, 0
@@ -122,8 +177,7 @@ def graph_time_data(created_data, closed_data, title, file_name, y_label):
             work_per_day = work_in_sample / float(days_spent)
             days_left = int(math.ceil(work_left / work_per_day))
 
-    plt.close('all')
-    _, ax = plt.subplots(1)
+    fig, (ax,) = rendering.figure('time data')
     ax.fill_between(
         [x[0] for x in created_series],
         [x[1] for x in created_series],
@@ -142,25 +196,51 @@ def graph_time_data(created_data, closed_data, title, file_name, y_label):
         [x[1] for x in closed_series],
         label='%s Closed' % y_label,
         color='black')
+    if forecast:
+        ax.fill_between(forecast.fan_dates, forecast.fan[5], forecast.fan[95], color='blue', alpha=.15, linewidth=0)
+        ax.fill_between(forecast.fan_dates, forecast.fan[25], forecast.fan[75], color='blue', alpha=.3, linewidth=0)
+        ax.plot(forecast.fan_dates, forecast.fan[50], label='Forecast', color='blue', linestyle='--')
     if days_spent and days_left:
         title += '\nApproximate Days Left: %i (%i-day sample)' % (days_left, days_spent)
+    if forecast:
+        title += '\nForecast: %s' % forecast.summary()
     ax.set_title(title)
     ax.legend(loc='best')
     ax.set_ylabel(y_label)
-    ax.xaxis.set_major_locator(MONTHS)
-    ax.xaxis.set_major_formatter(MONTHS_FORMAT)
-    ax.xaxis.set_minor_locator(WEEKS)
-    ax.xaxis.set_minor_formatter(WEEKS_FORMAT)
-    plt.ylim(0, max_y_value)
-    plt.savefig(file_name, bbox_inches='tight')
+    rendering.format_date_axis(ax)
+    ax.set_ylim(0, max_y_value)
+    rendering.save(fig, file_name)
 
 def highlight_weekends(date_points, ax):
     today = date.today()
     saturdays = [
         date_point for date_point in date_points
         if date_point.weekday() == 5 and date_point != today]
-    for saturday in saturdays:
-        ax.axvspan(saturday, saturday + timedelta(days=1), facecolor='gray', edgecolor='none', alpha=.2)
+    if saturdays:
+        rendering.shade_days(ax, saturdays, facecolor='gray', edgecolor='none', alpha=.2)
+
+# {rate: [(date, points closed per dev-day over the last `rate` days)]} for
+# every day in `date_list`. Windows at the start of the series only cover the
+# days there are, and the rate is 0 once MAX_DAYS_WITHOUT_DEVS days have passed
+# without dev-days.
+def rolling_rates(date_list, closed_data, dev_days, rates):
+    MAX_DAYS_WITHOUT_DEVS = 3
+    rate_series = {rate: [] for rate in rates}
+    # Running totals up to (not including) each day, so any window sum is one subtraction.
+    total_closed, total_devs = [0], [0]
+    for day, date_point in enumerate(date_list, 1):
+        total_closed.append(total_closed[-1] + closed_data[date_point])
+        total_devs.append(total_devs[-1] + dev_days.get(date_point, 0))
+        recent_devs = total_devs[day] - total_devs[max(0, day - MAX_DAYS_WITHOUT_DEVS)]
+        for rate in rates:
+            if recent_devs:
+                start = max(0, day - rate)
+                window_closed = total_closed[day] - total_closed[start]
+                window_devs = total_devs[day] - total_devs[start]
+                rate_series[rate].append((date_point, window_closed * 1.0 / window_devs))
+            else:
+                rate_series[rate].append((date_point, 0))
+    return rate_series
 
 def graph_daily_rates(project, closed_data, file_name):
     dev_days = devs_per_day(project['dev_days'])
@@ -168,12 +248,9 @@ def graph_daily_rates(project, closed_data, file_name):
     date_list = get_date_list(dev_days, closed_data, today)
 
 
-    MAX_DAYS_WITHOUT_DEVS = 3
     closed_series, devs_series = [], []
-    rates = (ONE_WEEK * 4, ONE_WEEK * 2, ONE_WEEK)
-    rate_series = {rate: [] for rate in rates}
-    running_closed = {rate: deque(maxlen=rate) for rate in rates}
-    running_devs = {rate: deque(maxlen=rate) for rate in rates}
+    rates = tuple(ONE_WEEK * weeks for weeks in project.get('rate_weeks', DEFAULT_RATE_WEEKS))
+    rate_series = rolling_rates(date_list, closed_data, dev_days, rates)
     cum_closed_series = []
     cumulative_closed = 0
     for date_point in date_list:
@@ -183,15 +260,6 @@ def graph_daily_rates(project, closed_data, file_name):
         cumulative_closed += closed
         cum_closed_series.append((date_point, cumulative_closed))
 
-        for rate in rates:
-            running_closed[rate].append(closed)
-            running_devs[rate].append(devs)
-        for rate in rates:
-            if sum(list(running_devs[rate])[- MAX_DAYS_WITHOUT_DEVS:]):
-                rate_series[rate].append((date_point, sum(running_closed[rate]) * 1.0 / sum(running_devs[rate])))
-            else:
-                rate_series[rate].append((date_point, 0))
-
         if closed_data[date_point]:
             closed_series.append((date_point, closed))
         if devs:
@@ -199,8 +267,7 @@ def graph_daily_rates(project, closed_data, file_name):
 
     final_rate = {rate: rate_series[rate][-1][1] for rate in rates}
 
-    plt.close('all')
-    _, ax = plt.subplots(1)
+    fig, (ax, ax_devs, ax_rate) = rendering.figure('daily rates', twin_axes=2)
 
     ax.plot(
         [x[0] for x in cum_closed_series],
@@ -217,23 +284,14 @@ def graph_daily_rates(project, closed_data, file_name):
     ax.set_ylim(0, max_y_points)
     ax.set_ylabel('Cumulative Points Closed')
 
-    ax_devs = ax.twinx()
     max_devs = max(val for date_point, val in devs_series)
-    for count in range(max_devs, 1, -1):
-        ax_devs.bar(
-            [x[0] for x in devs_series],
-            [count if x[1] >= count else 0 for x in devs_series],
-            BAR_WIDTH,
-            align='center',
-            color='green', edgecolor='white',
-            linewidth=.5)
-    ax_devs.bar(
+    rendering.stacked_unit_bars(
+        ax_devs,
         [x[0] for x in devs_series],
-        [1 for x in devs_series],
+        [x[1] for x in devs_series],
         BAR_WIDTH,
-        align='center',
         label='Developers',
-        color='green', edgecolor='white',
+        facecolor='green', edgecolor='white',
         linewidth=.5)
 
     max_y_devs = 5 * max_devs
@@ -241,8 +299,8 @@ def graph_daily_rates(project, closed_data, file_name):
     ax_devs.set_yticklabels([])
     ax_devs.set_yticks([])
 
-    ax_rate = ax.twinx()
-    for rate, linestyle, linewidth in zip(rates, ('-', '--', ':'), (2, 1, 1)):
+    line_styles = chain([('-', 2)], cycle([('--', 1), (':', 1), ('-.', 1)]))
+    for rate, (linestyle, linewidth) in zip(rates, line_styles):
         ax_rate.plot(
             [x[0] for x in rate_series[rate]],
             [x[1] for x in rate_series[rate]],
@@ -261,25 +319,23 @@ def graph_daily_rates(project, closed_data, file_name):
             axis.get_legend_handles_labels()
             for axis in (ax, ax_devs, ax_rate)))]
     ax.legend(handles, labels, loc='upper center', fontsize='small')
-    ax.xaxis.set_major_locator(MONTHS)
-    ax.xaxis.set_major_formatter(MONTHS_FORMAT)
-    ax.xaxis.set_minor_locator(WEEKS)
-    ax.xaxis.set_minor_formatter(WEEKS_FORMAT)
+    rendering.format_date_axis(ax)
     highlight_weekends(date_list, ax)
-    plt.savefig(file_name, bbox_inches='tight')
+    rendering.save(fig, file_name)
 
 # For graphing
 def collect_time_data(created_data, closed_data):
     today = date.fromordinal(date.today().toordinal())
-    date_list = get_date_list(created_data, closed_data, today)
 
+    # Only days with events matter here, so there is no need to walk every day
+    # of the project's history.
     created_by_week, closed_by_week = defaultdict(int), defaultdict(int)
-    cumulative_created = 0
-    for date_point in date_list:
-        weeks_ago = min(4, (today - date_point).days / ONE_WEEK)
-        cumulative_created += created_data[date_point]
-        created_by_week[weeks_ago] += created_data[date_point]
-        closed_by_week[weeks_ago] += closed_data[date_point]
+    for data, by_week in ((created_data, created_by_week), (closed_data, closed_by_week)):
+        for date_point, value in data.iteritems():
+            if date_point <= today:
+                weeks_ago = min(4, (today - date_point).days / ONE_WEEK)
+                by_week[weeks_ago] += value
+    cumulative_created = sum(created_by_week.itervalues())
 
     new_total_issues = cumulative_created
     new_issues = created_by_week[0]
@@ -304,55 +360,69 @@ def collect_time_data(created_data, closed_data):
     return sections
 
 def graph_projects(all_sections, file_name):
-    plt.close('all')
-    _, ax = plt.subplots(1)
-    for index, project_name in enumerate(sorted(all_sections.iterkeys())):
-        sections = all_sections[project_name]
-        plot = {}
-        for week in xrange(-2, 6):
-            plot[week] = plt.bar((index,), sections[week], BAR_WIDTH, color=GRAPH_COLORS[week], edgecolor='white', linewidth=.5)
-
-    plt.grid(which='major', axis='y', linestyle='solid', color='#e9e9e9')
-    plt.xticks([x + BAR_WIDTH / 2 for x in range(len(all_sections))], sorted(all_sections.iterkeys()))
-    plt.tick_params(axis='x', which='both', bottom='off', top='off')
-    plt.tick_params(axis='y', which='both', left='off', right='off', labelleft='off')
-    xmin, xmax = plt.xlim()
-    plt.xlim([xmin - (BAR_WIDTH / 2), xmax])
-#    plt.ylim(0, 200)
-
-    loc = plticker.MultipleLocator(base=GRID_WIDTH)
-    ax.yaxis.set_major_locator(loc)
+    fig, (ax,) = rendering.figure('projects')
+    project_names = sorted(all_sections.iterkeys())
+    # One bar call per section across all projects. A section is usually a
+    # one-item list, but collect_time_data can set it to a plain number.
+    for week in xrange(-2, 6):
+        heights = [
+            all_sections[name][week][0] if isinstance(all_sections[name][week], list) else all_sections[name][week]
+            for name in project_names]
+        ax.bar(range(len(project_names)), heights, BAR_WIDTH, color=GRAPH_COLORS[week], edgecolor='white', linewidth=.5)
+
+    ax.grid(which='major', axis='y', linestyle='solid', color='#e9e9e9')
+    ax.set_xticks([x + BAR_WIDTH / 2 for x in range(len(all_sections))])
+    ax.set_xticklabels(project_names)
+    ax.tick_params(axis='x', which='both', bottom='off', top='off')
+    ax.tick_params(axis='y', which='both', left='off', right='off', labelleft='off')
+    xmin, xmax = ax.get_xlim()
+    ax.set_xlim([xmin - (BAR_WIDTH / 2), xmax])
+#    ax.set_ylim(0, 200)
+
+    rendering.space_y_ticks(ax, GRID_WIDTH)
     ax.axhline(y=100, xmin=0, xmax=1, color='black', linestyle='dashed', linewidth=2)
     ax.set_axisbelow(True)
 
-    plt.savefig(file_name, bbox_inches='tight')
+    rendering.save(fig, file_name)
 
 
-def predict_completion(project, issues, high_priorities, done_statuses, story_points_field):
+# Simulates when the work left in a project will be done, from its recent
+# throughput and, if it has them, its dev-days.
+def project_forecast(project, created_by_date, closed_by_date):
+    num_closed = sum(closed_by_date.itervalues())
+    num_left = sum(created_by_date.itervalues()) - num_closed
+    dev_days = devs_per_day(project['dev_days']) if 'dev_days' in project else None
+    return forecast_completion(
+        closed_by_date, num_left, num_closed, dev_days,
+        sample_weeks=project.get('forecast_weeks', DEFAULT_SAMPLE_WEEKS))
+
+# Returns the completion prediction as text, so reports run in worker processes
+# can hand it back to be printed in project order.
+def predict_completion(project, table, high_priorities, story_points_field):
     project_name = project['name']
-    print '\nPROJECT: %s' % project_name
+    lines = ['\nPROJECT: %s' % project_name]
 
-    if not issues:
-        print '*** NO ISSUES FOUND'
-        return
+    if not len(table):
+        lines.append('*** NO ISSUES FOUND')
+        return '\n'.join(lines)
     if 'dev_days' in project:
         max_dev_week = max(project['dev_days'].iterkeys())
         if (date.today() - max_dev_week).days > 7:
-            print '*** DID YOU FORGET TO UPDATE DEV DAYS FOR %s THIS WEEK?' % project_name
+            lines.append('*** DID YOU FORGET TO UPDATE DEV DAYS FOR %s THIS WEEK?' % project_name)
 
         dev_days = sum(
             sum(int(day) for day in week.split(','))
             for week in project['dev_days'].itervalues())
-        print '%i dev-days so far' % dev_days
+        lines.append('%i dev-days so far' % dev_days)
     else:
         dev_days = 0
-        print '0 dev-days recorded'
-    print '-' * 20
+        lines.append('0 dev-days recorded')
+    lines.append('-' * 20)
 
     for use_story_points in (story_points_field, False):
         units = 'points' if use_story_points else 'stories'
-        created_by_date, closed_by_date = created_and_closed_by_date(
-            issues, high_priorities, done_statuses, use_story_points)
+        created_by_date, closed_by_date = table.created_and_closed_by_date(
+            high_priorities, bool(use_story_points))
         num_created = sum(created_by_date.itervalues())
         num_closed = sum(closed_by_date.itervalues())
         num_left = num_created - num_closed
@@ -360,41 +430,100 @@ def predict_completion(project, issues, high_priorities, done_statuses, story_po
         if dev_days:
             rate = 1.0 * num_closed / dev_days
 
-        print '%i %s closed' % (num_closed, units)
-        print '%i %s left' % (num_left, units)
+        lines.append('%i %s closed' % (num_closed, units))
+        lines.append('%i %s left' % (num_left, units))
         if num_closed:
             days_left = num_left / rate
-            print '%.1f %s per dev-day' % (rate, units)
-            print 'BY %s: ~%i dev days left (~%i dev weeks)' % (units.upper(), round(days_left), round(days_left / 5))
+            lines.append('%.1f %s per dev-day' % (rate, units))
+            lines.append('BY %s: ~%i dev days left (~%i dev weeks)' % (units.upper(), round(days_left), round(days_left / 5)))
+            forecast = project_forecast(project, created_by_date, closed_by_date)
+            if forecast:
+                lines.append('FORECAST BY %s: %s' % (units.upper(), forecast.summary()))
+            elif num_left > 0:
+                lines.append('FORECAST BY %s: No forecast within %i years' % (units.upper(), MAX_DAYS / 365))
         else:
-            print 'BY %s: Cannot prediction completion date yet' % units.upper()
-
-def main():
-    args = collect_options()
-    jira = JIRA(args.config_file)
-    all_projects = load_projects(args.projects_file)
-    if args.all_reports:
-        projects = all_projects
-        graph_type = None
-    else:
-        projects = prompt_for_projects(all_projects)
-        graph_type = prompt_for_graph_type()
-
-    all_sections = {}
-    for project in projects:
-        project_name = project['name']
-        issues = jira.query(project['query'], args.use_cache)
-        if not issues:
-            continue
-
-        issues = [
-            i for i in issues
-            if i['fields']['issuetype']['name'] != 'Epic']
-
-        if not graph_type or graph_type == 'completion':
-            predict_completion(project, issues, jira.high_priorities, jira.done_statuses, jira.story_points_field)
-
-        created_by_date, closed_by_date = created_and_closed_by_date(issues, jira.high_priorities, jira.done_statuses)
+            lines.append('BY %s: Cannot prediction completion date yet' % units.upper())
+    return '\n'.join(lines)
+
+def project_query(jira, args, project):
+    query = project['query']
+    if args.server_filter:
+        query = jira.server_filtered_query(query)
+    return query
+
+# Yields (index, table) for every project, with table None for projects without
+# any issues to report on. With --snapshots the table is the project's updated
+# DailySnapshot, which reports aggregate from the same way. Each distinct base query is fetched once (in a thread pool with
+# --jobs), and projects whose queries narrow it are filtered client-side.
+def fetch_project_tables(jira, args, projects):
+    queries = [project_query(jira, args, project) for project in projects]
+    plan = plan_queries(queries)
+    projects_by_base = OrderedDict()
+    for index, (base_query, _) in enumerate(plan):
+        projects_by_base.setdefault(base_query, []).append(index)
+
+    def fetch(base_query):
+        return base_query, jira.query(base_query, args.use_cache, args.incremental, args.stream)
+
+    thread_pool = ThreadPool(args.jobs) if args.jobs > 1 else None
+    try:
+        if thread_pool:
+            fetched = thread_pool.imap_unordered(fetch, projects_by_base.keys())
+        else:
+            fetched = imap(fetch, projects_by_base.keys())
+        for base_query, base_issues in fetched:
+            indexes = projects_by_base[base_query]
+            if len(indexes) > 1:
+                base_issues = list(base_issues)
+            for index in indexes:
+                timings = {}
+                with timer(timings, 'aggregate'):
+                    # With a single project on the query, cached issues stream
+                    # straight from disk into the table.
+                    issues = filter_issues(base_issues, plan[index][1])
+                    if args.history:
+                        table = HistoryTable(issue_histories(jira, issues), jira.done_statuses, exclude_types=('Epic',))
+                    else:
+                        table = IssueTable(
+                            issues, jira.done_statuses, jira.story_points_field,
+                            exclude_types=('Epic',), epic_link_field=jira.epic_link_field)
+                if args.snapshots:
+                    with timer(timings, 'snapshot'):
+                        table = update_snapshot(jira.cache, queries[index], table)
+                jira.metrics.add_timings(projects[index]['name'], timings)
+                yield index, table if len(table) else None
+    finally:
+        if thread_pool:
+            thread_pool.close()
+
+def load_project_snapshots(jira, args, projects):
+    for index, project in enumerate(projects):
+        timings = {}
+        with timer(timings, 'snapshot'):
+            snapshot = load_snapshot(jira.cache, project_query(jira, args, project))
+        jira.metrics.add_timings(project['name'], timings)
+        if not snapshot:
+            print '*** NO SNAPSHOT SAVED FOR %s' % project['name']
+        yield index, snapshot if snapshot and len(snapshot) else None
+
+def project_tables(jira, args, projects):
+    if args.from_snapshots:
+        return load_project_snapshots(jira, args, projects)
+    return fetch_project_tables(jira, args, projects)
+
+# Aggregates and renders one project. With --jobs this runs in a worker process,
+# so it only takes picklable arguments and returns its results and timings
+# instead of printing or recording them.
+def report_project(project, table, high_priorities, story_points_field, graph_type):
+    project_name = project['name']
+    timings = {}
+    completion = None
+    if not graph_type or graph_type == 'completion':
+        with timer(timings, 'completion'):
+            completion = predict_completion(project, table, high_priorities, story_points_field)
+
+    with timer(timings, 'aggregate'):
+        created_by_date, closed_by_date = table.created_and_closed_by_date(high_priorities)
         num_created = sum(created_by_date.itervalues())
         num_closed = sum(closed_by_date.itervalues())
         percent_complete = round(100.0 * num_closed / num_created)
@@ -403,25 +532,147 @@ def main():
             sections = defaultdict(list, {0: [0.0], 1: [0.0], 2: [0.0], 3: [0.0], 4: [0.0], 5: [100.0], -2: [0.0], -1: [0.0]})
         else:
             sections = collect_time_data(created_by_date, closed_by_date)
-        all_sections[project_name] = sections
 
-        if not graph_type or graph_type == 'points':
-            if 'dev_days' in project:
-                _, points_closed_by_date = created_and_closed_by_date(issues, jira.high_priorities, jira.done_statuses, jira.story_points_field)
+    if not graph_type or graph_type == 'points':
+        if 'dev_days' in project:
+            with timer(timings, 'daily rates graph'):
+                _, points_closed_by_date = table.created_and_closed_by_date(high_priorities, use_story_points=True)
                 graph_daily_rates(
                     project,
                     points_closed_by_date,
                     graph_file('%s daily rates' % project_name))
 
-        if not graph_type or graph_type == 'issues':
+    if not graph_type or graph_type == 'issues':
+        with timer(timings, 'issues graph'):
             graph_time_data(
                 created_by_date,
                 closed_by_date,
                 '%s Issues >= P2 (%i%% Complete)' % (project_name, percent_complete),
                 graph_file('%s issues over time' % project_name),
-                'Issues')
+                'Issues',
+                project_forecast(project, created_by_date, closed_by_date))
+
+    return sections, completion, timings
+
+def report_project_job(job):
+    return report_project(*job)
+
+# (project, table, priority filter) for each group of a project's issues that
+# --breakdown reports on. Each group is reported on like a project of its own,
+# with the project's dev-days. Groups come from the one table, by masking it.
+def breakdown_groups(project, table, breakdowns, high_priorities):
+    groups = []
+    if 'priority' in breakdowns:
+        for priority in sorted(table.priorities):
+            priority_filter = frozenset([priority.lower()])
+            # With --history, a priority whose issues have all been moved to
+            # another one is left with nothing created.
+            if priority.lower() in high_priorities and \
+                    sum(table.created_and_closed_by_date(priority_filter)[0].itervalues()) > 0:
+                groups.append((priority or 'No Priority', table, priority_filter))
+    if 'epic' in breakdowns:
+        epic_tables = table.group_by(table.epic, table.priority_mask(high_priorities))
+        for code, epic in sorted(enumerate(table.epics), key=lambda item: item[1]):
+            if code in epic_tables:
+                groups.append((epic or 'No Epic', epic_tables[code], high_priorities))
+    return [
+        (dict(project, name='%s - %s' % (project['name'], name)), group_table, priority_filter)
+        for name, group_table, priority_filter in groups]
+
+# Hands each project, and each of its groups with --breakdown, to a process
+# pool as soon as its issues arrive.
+def report_projects_in_parallel(jira, args, projects, graph_type):
+    process_pool = Pool(args.jobs)
+    try:
+        pending = []
+        for index, table in project_tables(jira, args, projects):
+            result, groups = None, []
+            if table:
+                job = (projects[index], table, jira.high_priorities, jira.story_points_field, graph_type)
+                result = process_pool.apply_async(report_project_job, (job,))
+                for group, group_table, priority_filter in breakdown_groups(
+                        projects[index], table, args.breakdown or (), jira.high_priorities):
+                    job = (group, group_table, priority_filter, jira.story_points_field, graph_type)
+                    groups.append((group['name'], process_pool.apply_async(report_project_job, (job,))))
+            pending.append((index, result, groups))
+
+        for index, result, groups in pending:
+            yield index, result and result.get() + ([(name, group.get()) for name, group in groups],)
+    finally:
+        process_pool.close()
+        process_pool.join()
+
+# Yields (index, (sections, completion, timings, groups)) for every project,
+# where groups is a list of (name, (sections, completion, timings)).
+def report_projects(jira, args, projects, graph_type):
+    for index, table in project_tables(jira, args, projects):
+        result = None
+        if table:
+            result = report_project(projects[index], table, jira.high_priorities, jira.story_points_field, graph_type)
+            groups = [
+                (group['name'], report_project(group, group_table, priority_filter, jira.story_points_field, graph_type))
+                for group, group_table, priority_filter in breakdown_groups(
+                    projects[index], table, args.breakdown or (), jira.high_priorities)]
+            result += (groups,)
+        yield index, result
+
+# Re-orders (index, result) pairs that arrive in any order, yielding each result
+# as soon as every project before it is done.
+def in_project_order(results):
+    ready = {}
+    next_index = 0
+    for index, result in results:
+        ready[index] = result
+        while next_index in ready:
+            yield next_index, ready.pop(next_index)
+            next_index += 1
+
+def main():
+    args = collect_options()
+    rendering.configure(args.format, args.dpi)
+    jira = JIRA(args.config_file)
+    assert 'epic' not in (args.breakdown or ()) or jira.epic_link_field, \
+        'Set epic_link_field under [jira] in the config to break reports down by epic'
+    all_projects = load_projects(args.projects_file)
+    if args.all_reports:
+        projects = all_projects
+        graph_type = None
+    else:
+        projects = prompt_for_projects(all_projects)
+        graph_type = prompt_for_graph_type()
+
+    if args.jobs > 1:
+        results = report_projects_in_parallel(jira, args, projects, graph_type)
+    else:
+        results = report_projects(jira, args, projects, graph_type)
+
+    all_sections = {}
+    with jira.metrics.stage('fetch and report'):
+        for index, result in in_project_order(results):
+            if not result:
+                continue
+            sections, completion, timings, groups = result
+            if completion:
+                print completion
+            all_sections[projects[index]['name']] = sections
+            jira.metrics.add_timings(projects[index]['name'], timings)
+            for name, (_, group_completion, group_timings) in groups:
+                if group_completion:
+                    print group_completion
+                jira.metrics.add_timings(name, group_timings)
+    jira.cache.evict()
 
     if not graph_type or graph_type == 'projects':
-        graph_projects(all_sections, graph_file('all projects'))
+        with jira.metrics.stage('all projects graph'):
+            graph_projects(all_sections, graph_file('all projects'))
+
+    if args.cache_stats:
+        print '\n%s' % jira.cache.report()
+
+    if args.metrics:
+        jira.metrics.write_json(args.metrics)
+    if args.prometheus:
+        jira.metrics.write_prometheus(args.prometheus)
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+import gzip
+import json
+import os
+from sha import sha
+from threading import Lock
+import time
+
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+MEGABYTE = 1024 * 1024
+# zlib's own default. gzip.open defaults to 9, which is several times slower to write
+# for a few percent smaller files.
+COMPRESS_LEVEL = 6
+CACHE_SUFFIXES = ('cached.jsonl.gz', 'cached.json', 'meta.json', 'daily.json', 'daily-issues.json')
+
+
+def read_json(file_name):
+    with open(file_name, 'r') as f:
+        raw_json = f.read()
+        return json.loads(raw_json)
+
+def write_json(file_name, data):
+    with open(file_name, 'w') as f:
+        f.write(json.dumps(data))
+
+
+class QueryCache(object):
+    """Issues cached per JQL query, one set of SHA-named files per query.
+
+    `<sha>.cached.jsonl.gz` holds the issues, one JSON object per line, so they
+    can be written and read back one issue at a time. `<sha>.cached.json` files
+    from older versions are still read. `<sha>.meta.json` holds the query,
+    the newest `updated` timestamp, when it was fetched and when it was last
+    read. Entries older than `max_age_hours` are not served, entries unused
+    for `max_idle_days` are deleted, and the least recently used entries are
+    deleted once the directory grows past `max_size_mb`. Nothing is deleted
+    until `evict` is called, once a run has finished reading and writing the
+    cache, so lazily read or half-written files are never pulled out from
+    under a report. Daily snapshots kept in the same directory count towards
+    the same limits. The issue history store bounds itself to them.
+    """
+
+    def __init__(self, directory, max_age_hours=None, max_idle_days=None, max_size_mb=None):
+        self.directory = directory
+        self.max_age = max_age_hours and max_age_hours * HOUR
+        self.max_idle = max_idle_days and max_idle_days * DAY
+        self.max_size = max_size_mb and max_size_mb * MEGABYTE
+        # What happened to each query this run: hit, stale, miss or sync.
+        self.stats = OrderedDict()
+        self.lock = Lock()
+
+    def cache_file(self, query, suffix='cached.jsonl.gz'):
+        if self.directory:
+            hash_value = sha(query).hexdigest()
+            file_name = '%s.%s' % (hash_value, suffix)
+            return os.path.join(self.directory, file_name)
+
+    def legacy_cache_file(self, query):
+        return self.cache_file(query, 'cached.json')
+
+    def meta_file(self, query):
+        return self.cache_file(query, 'meta.json')
+
+    # The cache file to read a query from, preferring the current format.
+    def existing_cache_file(self, query):
+        if self.directory:
+            for file_name in (self.cache_file(query), self.legacy_cache_file(query)):
+                if os.path.isfile(file_name):
+                    return file_name
+
+    def has(self, query):
+        return bool(self.existing_cache_file(query))
+
+    # Metadata for a cached query. Caches written before metadata existed get
+    # what the file system knows about them.
+    def meta(self, query):
+        if os.path.isfile(self.meta_file(query)):
+            return read_json(self.meta_file(query))
+        modified = os.path.getmtime(self.existing_cache_file(query))
+        return {'query': query, 'updated': '', 'last_full_sync': modified,
+                'fetched_at': modified, 'last_access': modified}
+
+    def age(self, query):
+        return time.time() - self.meta(query).get('fetched_at', 0)
+
+    def is_fresh(self, query):
+        return self.has(query) and not (self.max_age and self.age(query) > self.max_age)
+
+    def record(self, query, result):
+        age = self.age(query) if self.has(query) else None
+        self.stats[query] = (result, age)
+
+    # Returns an iterator over the cached issues, decoded one at a time.
+    def read(self, query):
+        file_name = self.existing_cache_file(query)
+        with self.lock:
+            meta = self.meta(query)
+            meta['last_access'] = time.time()
+            write_json(self.meta_file(query), meta)
+        if file_name == self.legacy_cache_file(query):
+            return iter(read_json(file_name))
+        return self.iter_issues(file_name)
+
+    def iter_issues(self, file_name):
+        with gzip.open(file_name, 'rb') as f:
+            for line in f:
+                yield json.loads(line)
+
+    # Yields `issues` back as each one is written, so they can be cached and
+    # aggregated in a single pass. The cached query is only replaced once every
+    # issue has been read; if iterating stops early it is left as it was.
+    def write_through(self, query, issues, last_full_sync, fetched_at=None):
+        if not self.directory:
+            for issue in issues:
+                yield issue
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        file_name = self.cache_file(query)
+        partial_file_name = '%s.partial' % file_name
+        updated = ''
+        try:
+            with gzip.open(partial_file_name, 'wb', COMPRESS_LEVEL) as f:
+                for issue in issues:
+                    f.write(json.dumps(issue))
+                    f.write('\n')
+                    updated = max(updated, issue['fields'].get('updated') or '')
+                    yield issue
+        except BaseException:
+            os.remove(partial_file_name)
+            raise
+
+        now = time.time()
+        with self.lock:
+            os.rename(partial_file_name, file_name)
+            if os.path.isfile(self.legacy_cache_file(query)):
+                os.remove(self.legacy_cache_file(query))
+            write_json(self.meta_file(query), {
+                'query': query,
+                'updated': updated,
+                'last_full_sync': last_full_sync,
+                'fetched_at': fetched_at or now,
+                'last_access': now,
+            })
+
+    # {sha: (last_access, total_bytes, [file names])} for everything in the directory.
+    def entries(self):
+        entries = {}
+        for file_name in os.listdir(self.directory):
+            hash_value, _, suffix = file_name.partition('.')
+            if suffix not in CACHE_SUFFIXES:
+                continue
+            path = os.path.join(self.directory, file_name)
+            last_access, size, paths = entries.get(hash_value, (0, 0, []))
+            if suffix == 'meta.json':
+                last_access = max(last_access, read_json(path).get('last_access', 0))
+            else:
+                last_access = max(last_access, os.path.getmtime(path))
+            entries[hash_value] = (last_access, size + os.path.getsize(path), paths + [path])
+        return entries
+
+    def evict(self):
+        if not (self.max_idle or self.max_size) or not (self.directory and os.path.isdir(self.directory)):
+            return
+        entries = sorted(self.entries().itervalues())
+        now = time.time()
+        total_size = sum(size for _, size, _ in entries)
+        for last_access, size, paths in entries:
+            idle = self.max_idle and now - last_access > self.max_idle
+            too_big = self.max_size and total_size > self.max_size
+            if not (idle or too_big):
+                break
+            for path in paths:
+                os.remove(path)
+            total_size -= size
+
+    def report(self):
+        lines = ['%-6s %8s  %s' % ('CACHE', 'AGE', 'QUERY')]
+        for query, (result, age) in self.stats.iteritems():
+            age_string = '%.1fh' % (age / HOUR) if age is not None else '-'
+            lines.append('%-6s %8s  %s' % (result, age_string, query))
+        return '\n'.join(lines)
@@ -0,0 +1,166 @@
+import re
+
+from utils import NAMED_FIELDS
+
+
+ORDER_BY = re.compile(r'\s+order\s+by\s+.*$', re.IGNORECASE)
+QUOTED = re.compile(r'("[^"]*"|\'[^\']*\')')
+OPERATOR = re.compile(r'\s*(!=|>=|<=|!~|=|~|>|<)\s*')
+WHITESPACE = re.compile(r'\s+')
+TOP_LEVEL_AND = re.compile(r'\s+and\s+', re.IGNORECASE)
+TOP_LEVEL_OR = re.compile(r'\s+or\s+', re.IGNORECASE)
+# Simple predicates on fields we always fetch, so they can be checked client-side.
+PREDICATE = re.compile(r'^(\w+) (=|!=|in|not in) (.+)$')
+# A single value: quoted, or one bare word.
+VALUE = re.compile(r'^(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'(),]+))$')
+# Bare words JQL gives a meaning of their own rather than treating as a name.
+KEYWORDS = frozenset(['empty', 'null'])
+FIELD_ALIASES = {'type': 'issuetype'}
+
+
+def normalize_clause(clause):
+    def normalize_unquoted(text):
+        return WHITESPACE.sub(' ', OPERATOR.sub(r' \1 ', text)).lower()
+    parts = QUOTED.split(clause)
+    return ''.join(
+        normalize_unquoted(part) if index % 2 == 0 else part
+        for index, part in enumerate(parts)).strip()
+
+# Blanks out quoted strings and anything nested in parentheses, so keyword
+# searches only match at the top level of the clause.
+def mask_nested(clause):
+    masked, depth, quote = [], 0, None
+    for char in clause:
+        if quote:
+            if char == quote:
+                quote = None
+            masked.append('_')
+        elif char in '"\'':
+            quote = char
+            masked.append('_')
+        elif char == '(':
+            depth += 1
+            masked.append('_')
+        elif char == ')':
+            depth -= 1
+            masked.append('_')
+        else:
+            masked.append(char if depth == 0 else '_')
+    return ''.join(masked)
+
+def mask_quotes(clause):
+    return QUOTED.sub(lambda match: '_' * len(match.group(0)), clause)
+
+def strip_parentheses(clause):
+    clause = clause.strip()
+    while clause.startswith('(') and clause.endswith(')'):
+        # "(a) AND (b)" starts and ends with parentheses that do not match each other.
+        depth = 0
+        for char in mask_quotes(clause[1:-1]):
+            depth += {'(': 1, ')': -1}.get(char, 0)
+            if depth < 0:
+                return clause
+        clause = clause[1:-1].strip()
+    return clause
+
+def split_top_level(clause, separator):
+    masked = mask_nested(clause)
+    parts, start = [], 0
+    for match in separator.finditer(masked):
+        parts.append(clause[start:match.start()])
+        start = match.end()
+    parts.append(clause[start:])
+    return parts
+
+# The set of ANDed clauses a query is made of, e.g.
+# "(project = A) AND issuetype != Epic" -> {"project = a", "issuetype != epic"}
+def conjuncts(query):
+    query = strip_parentheses(ORDER_BY.sub('', query))
+    if len(split_top_level(query, TOP_LEVEL_OR)) > 1:
+        # Kept in parentheses so it is never mistaken for a simple predicate.
+        return frozenset(['(%s)' % normalize_clause(query)])
+    clauses = set()
+    for part in split_top_level(query, TOP_LEVEL_AND):
+        clauses.update(conjuncts(part) if part.strip().startswith('(') else [normalize_clause(part)])
+    return frozenset(clauses)
+
+# The name a single JQL value stands for, or None if it is anything else: an
+# expression, a keyword like EMPTY, or a numeric ID that Jira would look up
+# by ID rather than by name.
+def parse_value(value):
+    match = VALUE.match(value.strip())
+    if not match:
+        return None
+    bare = match.group(3)
+    if bare in KEYWORDS:
+        return None
+    name = next(group for group in match.groups() if group is not None)
+    if not name or name.isdigit():
+        return None
+    return name
+
+# (field, lowercased values, negated) for a clause we can check exactly against
+# fetched issues, or None. Like JQL, none of these match issues where the field
+# is empty.
+def parse_filter(clause):
+    match = PREDICATE.match(clause)
+    if not match:
+        return None
+    field, operator, value = match.groups()
+    field = FIELD_ALIASES.get(field, field)
+    if field not in NAMED_FIELDS:
+        return None
+    if operator in ('in', 'not in'):
+        if not (value.startswith('(') and value.endswith(')')):
+            return None
+        values = value[1:-1].split(',')
+    else:
+        values = [value]
+    names = [parse_value(v) for v in values]
+    if not all(names):
+        return None
+    return field, frozenset(name.lower() for name in names), operator in ('!=', 'not in')
+
+def matches_filters(issue, filters):
+    fields = issue['fields']
+    for field, values, negated in filters:
+        name = (fields.get(field) or {}).get('name')
+        if not name or (name.lower() in values) == negated:
+            return False
+    return True
+
+def filter_issues(issues, filters):
+    if not filters:
+        return issues
+    return (issue for issue in issues if matches_filters(issue, filters))
+
+
+def plan_queries(queries):
+    """Works out which queries actually need to be sent to Jira.
+
+    Queries that only differ in whitespace, case or ORDER BY are fetched once.
+    A query that is another query ANDed with simple issuetype/status/priority
+    clauses is served from that query's issues, filtered client-side.
+
+    Returns a (base_query, filters) pair for each query, in the same order.
+    """
+    clauses_by_query = dict((query, conjuncts(query)) for query in set(queries))
+    base_by_clauses = {}
+    base_queries = []
+    for query in sorted(clauses_by_query, key=lambda q: (len(clauses_by_query[q]), queries.index(q))):
+        clauses = clauses_by_query[query]
+        if clauses in base_by_clauses:
+            continue
+        best = None
+        for base_query in base_queries:
+            base_clauses = clauses_by_query[base_query]
+            if base_clauses < clauses:
+                filters = [parse_filter(clause) for clause in clauses - base_clauses]
+                if all(filters) and (not best or len(base_clauses) > len(clauses_by_query[best[0]])):
+                    best = (base_query, filters)
+        if best:
+            base_by_clauses[clauses] = best
+        else:
+            base_by_clauses[clauses] = (query, [])
+            base_queries.append(query)
+    return [base_by_clauses[clauses_by_query[query]] for query in queries]
@@ -0,0 +1,85 @@
+# Shared matplotlib plumbing for the report graphs.
+#
+# matplotlib is only imported once a graph is rendered, so text-only reports
+# don't pay for it. Graphs are only ever saved to files, so it always uses Agg.
+#
+# Each graph type keeps one figure and its axes for the life of the process.
+# They are cleared and redrawn for every project instead of being rebuilt.
+
+
+OUTPUT_FORMAT = 'png'
+OUTPUT_FORMATS = ('png', 'svg', 'pdf')
+DPI = None  # None uses matplotlib's default
+FIGURES = {}
+
+
+def configure(output_format=None, dpi=None):
+    global OUTPUT_FORMAT, DPI
+    assert output_format in OUTPUT_FORMATS + (None,), 'Unknown output format: %s' % output_format
+    OUTPUT_FORMAT = output_format or OUTPUT_FORMAT
+    DPI = dpi or DPI
+
+def pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+# Returns (figure, [axes, twin axes...]) for `graph_type`, cleared and ready to draw on.
+def figure(graph_type, twin_axes=0):
+    if graph_type not in FIGURES:
+        fig, ax = pyplot().subplots(1)
+        FIGURES[graph_type] = (fig, [ax] + [ax.twinx() for _ in range(twin_axes)])
+
+    fig, axes = FIGURES[graph_type]
+    for ax in axes:
+        ax.cla()
+    # cla() undoes what twinx() set up for the twin axes.
+    for twin in axes[1:]:
+        twin.yaxis.tick_right()
+        twin.yaxis.set_label_position('right')
+        twin.xaxis.set_visible(False)
+        twin.patch.set_visible(False)
+    return fig, axes
+
+def save(fig, file_name):
+    fig.savefig(file_name, bbox_inches='tight', dpi=DPI)
+
+def format_date_axis(ax):
+    import matplotlib.dates as mdates
+    ax.xaxis.set_major_locator(mdates.MonthLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter(''))
+    ax.xaxis.set_minor_locator(mdates.DayLocator(interval=7))
+    ax.xaxis.set_minor_formatter(mdates.DateFormatter('%b\n%-d'))
+
+# Puts the major y ticks, and so the grid lines, every `step`.
+def space_y_ticks(ax, step):
+    import matplotlib.ticker as mticker
+    ax.yaxis.set_major_locator(mticker.MultipleLocator(base=step))
+
+# Draws each day's value as a stack of unit-high bars, all in one collection
+# rather than one patch per bar.
+def stacked_unit_bars(ax, dates, heights, width, **kwargs):
+    import matplotlib.dates as mdates
+    from matplotlib.collections import PolyCollection
+    boxes = []
+    for x, height in zip(mdates.date2num(dates), heights):
+        left, right = x - width / 2.0, x + width / 2.0
+        boxes.extend(
+            [(left, level), (right, level), (right, level + 1), (left, level + 1)]
+            for level in xrange(height))
+    bars = PolyCollection(boxes, **kwargs)
+    ax.add_collection(bars)
+    ax.autoscale_view()
+    return bars
+
+# Shades whole days across the full height of the axes, in one collection.
+def shade_days(ax, dates, **kwargs):
+    import matplotlib.dates as mdates
+    from matplotlib.collections import PolyCollection
+    spans = [
+        [(x, 0), (x + 1, 0), (x + 1, 1), (x, 1)]
+        for x in mdates.date2num(dates)]
+    shading = PolyCollection(spans, transform=ax.get_xaxis_transform(), **kwargs)
+    ax.add_collection(shading, autolim=False)
+    return shading
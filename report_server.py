@@ -0,0 +1,251 @@
+#!/usr/bin/python
+
+# Serves the project reports over HTTP, refreshing them in the background.
+#
+# Issues are synced incrementally on every refresh and the reports are kept in
+# memory, so requests never wait on JIRA or matplotlib.
+#
+# To run:
+#     `./report_server.py --port 8080 --interval 15 jira.cfg projects.yml`
+
+
+from argparse import ArgumentParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
+import httplib
+import json
+import os
+from SocketServer import ThreadingMixIn
+from threading import Event, Thread
+import time
+import traceback
+import urllib
+
+from jira_connect import JIRA
+from metrics import Metrics
+import project_report
+import rendering
+from utils import load_projects
+
+
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml', 'pdf': 'application/pdf'}
+
+
+def collect_options():
+    parser = ArgumentParser()
+    parser.add_argument(
+        'config_file', help='The config file to parse.')
+    parser.add_argument(
+        'projects_file', help='The project file to parse. It is re-read on every refresh.')
+    parser.add_argument(
+        '--host', default='127.0.0.1',
+        help='Address to listen on.')
+    parser.add_argument(
+        '--port', type=int, default=8080,
+        help='Port to listen on.')
+    parser.add_argument(
+        '--interval', type=float, default=15,
+        help='Minutes between refreshes.')
+    parser.add_argument(
+        '-s', '--server-filter', action='store_true',
+        help='Exclude Epics and non-whitelisted priorities in the JQL query instead of after fetching.')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='Fetch and report on this many projects at the same time.')
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='Cache and aggregate issues as each search page arrives instead of holding them all in memory.')
+    parser.add_argument(
+        '--snapshots', action='store_true',
+        help='Keep per-project daily totals in the cache directory and report from them.')
+    parser.add_argument(
+        '--history', action='store_true',
+        help='Rebuild each day\'s status, priority and points from the issue changelogs.')
+    parser.add_argument(
+        '--format', choices=rendering.OUTPUT_FORMATS, default=rendering.OUTPUT_FORMAT,
+        help='File format for the graphs.')
+    parser.add_argument(
+        '--dpi', type=int,
+        help='Resolution for png graphs.')
+    # Every refresh syncs the cache with what changed in JIRA since the last one.
+    parser.set_defaults(use_cache=False, incremental=True, from_snapshots=False, breakdown=None)
+    args = parser.parse_args()
+    if args.history and args.snapshots:
+        parser.error('--history cannot be combined with --snapshots')
+    return args
+
+def read_graph(file_name):
+    if os.path.isfile(file_name):
+        with open(file_name, 'rb') as f:
+            return f.read()
+
+
+class Reports(object):
+    """The latest reports for every project, rebuilt by a background thread.
+
+    Each refresh builds a complete new set of reports and swaps it in at the
+    end, so requests always see one consistent refresh and never block on one
+    in progress. Rendering only ever happens on the refresh thread, which
+    keeps matplotlib's shared figures to a single thread.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.jira = JIRA(args.config_file)
+        self.interval = args.interval * 60
+        self.projects = []
+        self.graphs = {}
+        self.all_projects_graph = None
+        self.refreshed_at = None
+        self.error = None
+        self.metrics = None
+        self.wake_up = Event()
+
+    def start(self):
+        thread = Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+                self.error = None
+            except Exception:
+                # Keep serving the last good reports until the next refresh works.
+                self.error = traceback.format_exc()
+                print self.error
+            self.wake_up.wait(self.interval)
+            self.wake_up.clear()
+
+    def request_refresh(self):
+        self.wake_up.set()
+
+    def refresh(self):
+        jira, args = self.jira, self.args
+        jira.metrics = Metrics()
+        projects = load_projects(args.projects_file)
+        if args.jobs > 1:
+            results = project_report.report_projects_in_parallel(jira, args, projects, None)
+        else:
+            results = project_report.report_projects(jira, args, projects, None)
+
+        reports, graphs, all_sections = [], {}, {}
+        with jira.metrics.stage('fetch and report'):
+            for index, result in project_report.in_project_order(results):
+                project = projects[index]
+                report = OrderedDict([('name', project['name']), ('completion', None), ('graphs', [])])
+                if result:
+                    sections, completion, timings, _ = result
+                    jira.metrics.add_timings(project['name'], timings)
+                    all_sections[project['name']] = sections
+                    report['completion'] = completion
+                    for graph_type in ('%s daily rates', '%s issues over time'):
+                        url = self.keep_graph(graphs, graph_type % project['name'])
+                        if url:
+                            report['graphs'].append(url)
+                reports.append(report)
+        jira.cache.evict()
+
+        with jira.metrics.stage('all projects graph'):
+            project_report.graph_projects(all_sections, project_report.graph_file('all projects'))
+        all_projects_graph = self.keep_graph(graphs, 'all projects')
+        jira.metrics.finish()
+
+        self.projects, self.graphs, self.all_projects_graph = reports, graphs, all_projects_graph
+        self.metrics = jira.metrics
+        self.refreshed_at = time.time()
+
+    # Reads a freshly rendered graph into `graphs` and returns its URL.
+    def keep_graph(self, graphs, graph_type):
+        file_name = project_report.graph_file(graph_type)
+        data = read_graph(file_name)
+        if data is not None:
+            name = os.path.basename(file_name)
+            graphs[name] = data
+            return '/graphs/%s' % urllib.quote(name)
+
+    def index(self):
+        return OrderedDict([
+            ('refreshed_at', self.refreshed_at),
+            ('refresh_seconds', self.metrics and self.metrics.summary()['seconds']),
+            ('error', self.error),
+            ('all_projects_graph', self.all_projects_graph),
+            ('projects', self.projects),
+        ])
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        reports = self.server.reports
+        path = urllib.unquote(self.path.split('?', 1)[0])
+        if reports.refreshed_at is None and path != '/status':
+            self.send_text(httplib.SERVICE_UNAVAILABLE, 'The first refresh has not finished yet.\n')
+        elif path == '/':
+            self.send_json(reports.index())
+        elif path.startswith('/graphs/') and path[len('/graphs/'):] in reports.graphs:
+            extension = path.rsplit('.', 1)[-1]
+            self.send(httplib.OK, CONTENT_TYPES.get(extension, 'application/octet-stream'),
+                      reports.graphs[path[len('/graphs/'):]])
+        elif path.startswith('/completion/'):
+            name = path[len('/completion/'):]
+            completion = [p['completion'] for p in reports.projects if p['name'] == name]
+            if completion and completion[0]:
+                self.send_text(httplib.OK, completion[0] + '\n')
+            else:
+                self.send_text(httplib.NOT_FOUND, 'No report for project %s\n' % name)
+        elif path == '/metrics':
+            self.send(httplib.OK, 'text/plain; version=0.0.4', reports.metrics.prometheus())
+        elif path == '/status':
+            self.send_json(OrderedDict([
+                ('refreshed_at', reports.refreshed_at),
+                ('error', reports.error),
+                ('metrics', reports.metrics and reports.metrics.summary()),
+            ]))
+        else:
+            self.send_text(httplib.NOT_FOUND, 'Not found\n')
+
+    # Starts a refresh now instead of waiting for the next one.
+    def do_POST(self):
+        if self.path == '/refresh':
+            self.server.reports.request_refresh()
+            self.send_text(httplib.ACCEPTED, 'Refreshing\n')
+        else:
+            self.send_text(httplib.NOT_FOUND, 'Not found\n')
+
+    def send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status, text):
+        self.send(status, 'text/plain; charset=utf-8', text.encode('utf-8'))
+
+    def send_json(self, data):
+        self.send(httplib.OK, 'application/json', json.dumps(data, indent=2))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReportServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, reports):
+        HTTPServer.__init__(self, address, ReportHandler)
+        self.reports = reports
+
+
+def main():
+    args = collect_options()
+    rendering.configure(args.format, args.dpi)
+    reports = Reports(args).start()
+    server = ReportServer((args.host, args.port), reports)
+    print 'Serving reports on http://%s:%i' % server.server_address
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
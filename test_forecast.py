@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+import unittest
+
+from forecast import forecast_completion, MAX_DAYS
+
+
+TODAY = date(2026, 1, 5)
+
+
+# Closes `work` on one day in `every` over the last twelve weeks.
+def closed_every(every, work=1):
+    return dict((TODAY - timedelta(days=offset), work) for offset in xrange(0, 12 * 7, every))
+
+
+class ForecastCompletionTest(unittest.TestCase):
+    def test_steady_throughput_is_forecast(self):
+        forecast = forecast_completion(closed_every(1), 10, today=TODAY, simulations=200)
+        self.assertEqual(forecast.dates[50], TODAY + timedelta(days=10))
+        self.assertEqual(forecast.fan_dates[-1], forecast.dates[95])
+        self.assertEqual(forecast.fan[50][-1], 10)
+
+    def test_percentiles_not_reached_have_no_forecast(self):
+        # One burst of work in twelve weeks: about half the simulations finish in time.
+        closed = {TODAY: 100, TODAY - timedelta(weeks=12): 0}
+        forecast = forecast_completion(closed, 1050, today=TODAY, simulations=200)
+        self.assertTrue(forecast.dates[50])
+        self.assertIsNone(forecast.dates[95])
+        self.assertIn('95%: no forecast', forecast.summary())
+        # The fan stops at the last forecast date rather than running on to MAX_DAYS.
+        self.assertEqual(forecast.fan_dates[-1], max(day for day in forecast.dates.itervalues() if day))
+        self.assertLess(forecast.fan_dates[-1], TODAY + timedelta(days=MAX_DAYS))
+
+    def test_no_forecast_when_nothing_finishes(self):
+        forecast = forecast_completion(closed_every(28), 10 ** 6, today=TODAY, simulations=50)
+        self.assertFalse(forecast)
+        self.assertEqual(list(forecast.fan_dates), [])
+
+    def test_no_forecast_without_throughput(self):
+        self.assertFalse(forecast_completion({}, 10, today=TODAY))
+
+
+if __name__ == '__main__':
+    unittest.main()
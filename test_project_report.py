@@ -0,0 +1,82 @@
+from collections import defaultdict
+from datetime import date, timedelta
+import random
+import unittest
+
+from issue_history import HistoryTable
+from project_report import breakdown_groups, report_project, rolling_rates
+
+
+START = date(2026, 1, 5)
+
+
+def days(count):
+    return [START + timedelta(days=offset) for offset in xrange(count)]
+
+def by_date(values):
+    data = defaultdict(int)
+    for offset, value in enumerate(values):
+        if value:
+            data[START + timedelta(days=offset)] = value
+    return data
+
+
+class RollingRatesTest(unittest.TestCase):
+    def assertRates(self, series, expected):
+        self.assertEqual([date_point for date_point, _ in series], days(len(expected)))
+        for (_, rate), expected_rate in zip(series, expected):
+            self.assertAlmostEqual(rate, expected_rate)
+
+    def test_windows_at_the_edges_of_the_series(self):
+        closed = by_date([2, 0, 1, 3, 0, 2, 0, 0, 1, 0])
+        devs = by_date([1, 1, 1, 1, 1, 1, 0, 0, 0, 0])
+        rates = rolling_rates(days(10), closed, devs, (3, 7))
+        # The first days only average over the days so far, and the rate drops
+        # to 0 once three days pass without dev-days.
+        self.assertRates(rates[3], [2, 1, 1, 4 / 3.0, 4 / 3.0, 5 / 3.0, 1, 2, 0, 0])
+        self.assertRates(rates[7], [2, 1, 1, 1.5, 1.2, 8 / 6.0, 8 / 6.0, 1.2, 0, 0])
+
+    def test_single_day(self):
+        rates = rolling_rates(days(1), by_date([3]), by_date([2]), (7,))
+        self.assertRates(rates[7], [1.5])
+
+    def test_matches_summing_each_window(self):
+        rng = random.Random(0)
+        closed_values = [rng.choice([0, 0, 1, 2, 3, 5]) for _ in xrange(200)]
+        devs_values = [rng.choice([0, 2, 3, 4]) for _ in xrange(200)]
+        rates = rolling_rates(days(200), by_date(closed_values), by_date(devs_values), (7, 14, 28))
+        for rate, series in rates.iteritems():
+            expected = []
+            for day in xrange(200):
+                if sum(devs_values[max(0, day - 2):day + 1]):
+                    window = slice(max(0, day - rate + 1), day + 1)
+                    expected.append(sum(closed_values[window]) * 1.0 / sum(devs_values[window]))
+                else:
+                    expected.append(0)
+            self.assertRates(series, expected)
+
+
+def history(key, priority, changes=()):
+    return {
+        'key': key, 'updated': '2026-01-09T10:00:00.000+0000', 'issuetype': 'Story', 'created': '2026-01-05',
+        'initial': {'status': 'Open', 'priority': priority, 'points': 1}, 'changes': list(changes)}
+
+
+class BreakdownTest(unittest.TestCase):
+    def test_priorities_left_with_nothing_created_are_skipped(self):
+        table = HistoryTable([
+            history('A-1', 'P3', [['2026-01-06', 'priority', 'P1'], ['2026-01-07', 'status', 'Done']]),
+            history('A-2', 'P1'),
+        ], frozenset(['done']))
+        project = {'name': 'A', 'dev_days': {START: '1, 1, 1, 1, 1'}}
+        high_priorities = frozenset(['p1', 'p3'])
+        groups = breakdown_groups(project, table, ('priority',), high_priorities)
+        self.assertEqual([group['name'] for group, _, _ in groups], ['A - P1'])
+        for group, group_table, priority_filter in groups:
+            _, completion, _ = report_project(group, group_table, priority_filter, None, 'completion')
+            self.assertIn('1 stories closed', completion)
+            self.assertIn('1 stories left', completion)
+
+
+if __name__ == '__main__':
+    unittest.main()
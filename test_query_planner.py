@@ -0,0 +1,47 @@
+import unittest
+
+from query_planner import plan_queries
+
+
+BASE = 'project = FAKE'
+
+
+class PlanQueriesTest(unittest.TestCase):
+    def plan(self, query):
+        return plan_queries([BASE, query])[1]
+
+    def test_same_query_is_fetched_once(self):
+        self.assertEqual(plan_queries([BASE, 'PROJECT=FAKE order by key']), [(BASE, []), (BASE, [])])
+
+    def test_simple_predicates_filter_the_base_query(self):
+        base_query, filters = self.plan(BASE + ' AND priority in (P1, "P2") AND issuetype != Epic')
+        self.assertEqual(base_query, BASE)
+        self.assertEqual(sorted(filters), [
+            ('issuetype', frozenset(['epic']), True),
+            ('priority', frozenset(['p1', 'p2']), False)])
+
+    def test_quoted_values_keep_spaces(self):
+        self.assertEqual(
+            self.plan(BASE + ' AND status = "In Progress"'),
+            (BASE, [('status', frozenset(['in progress']), False)]))
+        self.assertEqual(
+            self.plan(BASE + " AND status = 'In Progress'"),
+            (BASE, [('status', frozenset(['in progress']), False)]))
+
+    def test_or_groups_are_sent_to_jira(self):
+        query = BASE + ' AND (priority = P1 OR priority = P2)'
+        self.assertEqual(self.plan(query), (query, []))
+
+    def test_numeric_ids_are_sent_to_jira(self):
+        for query in (BASE + ' AND priority = 2', BASE + ' AND status in (Open, 10001)',
+                      BASE + ' AND status = "10001"'):
+            self.assertEqual(self.plan(query), (query, []))
+
+    def test_unparsable_values_are_sent_to_jira(self):
+        for query in (BASE + ' AND priority = EMPTY', BASE + ' AND status in ("a,b")',
+                      BASE + ' AND status = currentStatus()', BASE + ' AND status = Open Now'):
+            self.assertEqual(self.plan(query), (query, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
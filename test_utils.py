@@ -0,0 +1,65 @@
+from datetime import date
+import unittest
+
+from daily_snapshot import DailySnapshot
+from jira_connect import parse_config_names
+from utils import IssueTable
+
+
+CREATED = '2026-01-05T10:00:00.000+0000'
+RESOLVED = '2026-01-07T10:00:00.000+0000'
+
+
+def issue(key, status, priority='P1', resolved=RESOLVED):
+    return {'key': key, 'fields': {
+        'issuetype': {'name': 'Story'},
+        'status': {'name': status},
+        'priority': {'name': priority},
+        'created': CREATED,
+        'resolutiondate': resolved,
+    }}
+
+
+class ConfigNamesTest(unittest.TestCase):
+    def test_lower_cases_and_strips_each_name(self):
+        self.assertEqual(parse_config_names('[ Done , Won\'t Do,CLOSED ]'), frozenset(['done', 'won\'t do', 'closed']))
+        self.assertEqual(parse_config_names('Done, Closed'), frozenset(['done', 'closed']))
+        self.assertEqual(parse_config_names(''), frozenset())
+
+
+class ExactMatchingTest(unittest.TestCase):
+    done_statuses = parse_config_names('[Done, Won\'t Do]')
+
+    def closed(self, issues, priority_filter=parse_config_names('P1')):
+        table = IssueTable(issues, self.done_statuses)
+        return sum(table.created_and_closed_by_date(priority_filter)[1].itervalues())
+
+    def test_done_statuses_match_whole_names_in_any_case(self):
+        self.assertEqual(self.closed([issue('A-1', 'Done')]), 1)
+        self.assertEqual(self.closed([issue('A-1', 'DONE')]), 1)
+        self.assertEqual(self.closed([issue('A-1', 'won\'t do')]), 1)
+
+    def test_names_that_only_contain_a_done_status_are_not_done(self):
+        for status in ('Not Done', 'Done Soon', 'Won\'t', 'Do'):
+            self.assertEqual(self.closed([issue('A-1', status)]), 0, status)
+
+    def test_done_issues_need_a_resolution_date(self):
+        self.assertEqual(self.closed([issue('A-1', 'Done', resolved=None)]), 0)
+
+    def test_priorities_match_whole_names_in_any_case(self):
+        issues = [issue('A-1', 'Done', 'P1'), issue('A-2', 'Done', 'p1'), issue('A-3', 'Done', 'P10'),
+                  issue('A-4', 'Done', 'P2')]
+        self.assertEqual(self.closed(issues), 2)
+        self.assertEqual(self.closed(issues, parse_config_names('[p1, P10]')), 3)
+
+    def test_snapshot_priorities_match_in_any_case(self):
+        snapshot = DailySnapshot({
+            (date(2026, 1, 5).toordinal(), 'P1', False): [1, 0, 0, 0],
+            (date(2026, 1, 5).toordinal(), 'P10', False): [1, 0, 0, 0],
+        }, 2)
+        created, _ = snapshot.created_and_closed_by_date(parse_config_names('p1'))
+        self.assertEqual(dict(created), {date(2026, 1, 5): 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,18 @@
+from array import array
 from collections import defaultdict
-from datetime import datetime, timedelta
+import copy
+from datetime import date, datetime, timedelta
 
+import numpy as np
 import yaml
 
 
 DATE_FORMAT = '%Y-%m-%d'
 PROJECTS_FILE = 'projects.yml'
+# The only issue fields the reports read, besides the configured story points field.
+REPORT_FIELDS = ('issuetype', 'status', 'priority', 'created', 'resolutiondate', 'updated')
+# Fields whose values are objects; the reports only use their name.
+NAMED_FIELDS = ('issuetype', 'status', 'priority')
 
 
 def load_projects(projects_file):
@@ -16,29 +23,132 @@ def load_projects(projects_file):
 def story_points(issue, story_points_field):
     return int(issue['fields'].get(story_points_field) or 0)
 
+# Parses the date part of a Jira timestamp into an ordinal, parsing each distinct day once.
+def date_ordinal(timestamp, ordinals):
+    date_string = timestamp[:10]
+    ordinal = ordinals.get(date_string)
+    if ordinal is None:
+        ordinal = datetime.strptime(date_string, DATE_FORMAT).date().toordinal()
+        ordinals[date_string] = ordinal
+    return ordinal
+
+# {date1: total, date2: total, ...} summed from parallel arrays of ordinals and values.
+def sum_by_date(ordinals, values):
+    by_date = defaultdict(int)
+    if len(ordinals):
+        first = ordinals.min()
+        totals = np.bincount(ordinals - first, weights=values)
+        for offset in np.flatnonzero(totals):
+            by_date[date.fromordinal(int(first + offset))] = int(totals[offset])
+    return by_date
+
+
+class IssueTable(object):
+    """Issues flattened once into parallel arrays, so every report can aggregate
+    them without walking the issue dicts or parsing dates again.
+
+    Priorities and epics are stored as integer codes into `priorities` and
+    `epics`, where the epic is the key in `epic_link_field` ('' for issues
+    without one, or when no field is given). `closed` is 0 for issues that
+    are not done. `done_statuses` and the priority filters are
+    sets of lower-case names, and each distinct status or priority is only
+    looked up once.
+    """
+
+    def __init__(self, issues, done_statuses, story_points_field=None, exclude_types=(), epic_link_field=None):
+        keys = []
+        self.priorities = []
+        self.epics = []
+        priority_codes = {}
+        epic_codes = {}
+        ordinals = {}
+        done_by_status = {}
+
+        created, closed, points = array('i'), array('i'), array('i')
+        done, priority, epic = array('b'), array('i'), array('i')
+        for issue in issues:
+            fields = issue['fields']
+            if fields['issuetype']['name'] in exclude_types:
+                continue
+
+            status = fields['status']['name']
+            is_done = done_by_status.get(status)
+            if is_done is None:
+                is_done = done_by_status[status] = status.lower() in done_statuses
+            is_done = is_done and bool(fields['resolutiondate'])
+
+            priority_name = fields['priority']['name']
+            code = priority_codes.get(priority_name)
+            if code is None:
+                code = priority_codes[priority_name] = len(self.priorities)
+                self.priorities.append(priority_name)
+
+            epic_link = fields.get(epic_link_field) if epic_link_field else None
+            epic_key = (epic_link.get('key') if isinstance(epic_link, dict) else epic_link) or ''
+            epic_code = epic_codes.get(epic_key)
+            if epic_code is None:
+                epic_code = epic_codes[epic_key] = len(self.epics)
+                self.epics.append(epic_key)
+
+            keys.append(issue['key'])
+            created.append(date_ordinal(fields['created'], ordinals))
+            closed.append(date_ordinal(fields['resolutiondate'], ordinals) if is_done else 0)
+            points.append(story_points(issue, story_points_field) if story_points_field else 0)
+            done.append(is_done)
+            priority.append(code)
+            epic.append(epic_code)
+
+        self.keys = np.array(keys, dtype=object)
+        self.created = np.array(created, dtype=np.int32)
+        self.closed = np.array(closed, dtype=np.int32)
+        self.points = np.array(points, dtype=np.int32)
+        self.done = np.array(done, dtype=bool)
+        self.priority = np.array(priority, dtype=np.int32)
+        self.epic = np.array(epic, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    # The issues where `mask` is set, or at the indices in it, as a new table.
+    def select(self, mask):
+        table = copy.copy(self)
+        for name in ('keys', 'created', 'closed', 'points', 'done', 'priority', 'epic'):
+            setattr(table, name, getattr(self, name)[mask])
+        return table
+
+    # {code: table} for each code in a per-issue array of codes like `epic`
+    # with at least one issue where `mask` is set. The issues are grouped with
+    # one sort rather than one mask per code.
+    def group_by(self, codes, mask):
+        order = np.argsort(codes, kind='mergesort')
+        ends = np.cumsum(np.bincount(codes))
+        counted = np.bincount(codes[mask], minlength=len(ends))
+        tables = {}
+        start = 0
+        for code, end in enumerate(ends.tolist()):
+            if counted[code]:
+                tables[code] = self.select(order[start:end])
+            start = end
+        return tables
+
+    def priority_mask(self, priority_filter):
+        allowed = np.array([name.lower() in priority_filter for name in self.priorities], dtype=bool)
+        return allowed[self.priority]
+
+    # ({date1: num_created, date2: num_created, ...},
+    #  {date1: num_closed, date2: num_closed, ...})
+    def created_and_closed_by_date(self, priority_filter, use_story_points=False):
+        values = self.points if use_story_points else np.ones(len(self), dtype=np.int32)
+        counted = self.priority_mask(priority_filter) & (values != 0)
+        closed = counted & self.done
+        return (sum_by_date(self.created[counted], values[counted]),
+                sum_by_date(self.closed[closed], values[closed]))
+
 # ({date1: num_created, date2: num_created, ...},
 #  {date1: num_closed, date2: num_closed, ...})
 def created_and_closed_by_date(issues, priority_filter, done_statuses, story_points_field=None):
-    created_by_date = defaultdict(int)
-    closed_by_date = defaultdict(int)
-
-    for issue in issues:
-        status = issue['fields']['status']['name'].lower()
-        is_done = status in done_statuses
-        priority = issue['fields']['priority']['name']
-        if priority in priority_filter:
-            value = story_points(issue, story_points_field) if story_points_field else 1
-            if not value:
-                continue
-
-            created_string = issue['fields']['created'][:10]
-            created = datetime.strptime(created_string, DATE_FORMAT).date()
-            created_by_date[created] += value
-            if is_done:
-                closed_string = issue['fields']['resolutiondate'][:10]
-                closed = datetime.strptime(closed_string, DATE_FORMAT).date()
-                closed_by_date[closed] += value
-    return created_by_date, closed_by_date
+    table = IssueTable(issues, done_statuses, story_points_field)
+    return table.created_and_closed_by_date(priority_filter, bool(story_points_field))
 
 def devs_per_day(raw_dev_days):
     dev_days = {}